@@ -0,0 +1,69 @@
+# Import necessary libraries
+import asyncio  # For the semaphore and the bounded wait
+from contextlib import asynccontextmanager  # For the 'async with limiter.slot()' form
+
+# --- Admission Control ---
+# An expensive endpoint must not take every database connection and every worker thread,
+# or cheap requests queue up behind it. Each limited endpoint gets a ConcurrencyLimiter:
+# at most max_concurrent requests run, at most max_waiting more wait for a slot, and a
+# request waits at most max_wait_seconds. Everything beyond that is refused at once
+# instead of piling up (the API turns the errors below into 429 / 503).
+
+
+class WaitQueueFullError(Exception):
+    """Raised when all slots are busy and the wait queue is full."""
+
+
+class WaitTimeoutError(Exception):
+    """Raised when no slot became free within max_wait_seconds."""
+
+
+class ConcurrencyLimiter:
+    """Async concurrency limit with a bounded wait queue. Use from the event loop only."""
+
+    def __init__(self, name, max_concurrent, max_waiting, max_wait_seconds):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one slot for the duration of the 'async with' block."""
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()  # A slot is free: returns without suspending
+        elif self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise WaitQueueFullError(
+                f"'{self.name}' is busy ({self.running} running, {self.waiting} waiting), try again later."
+            )
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.max_wait_seconds)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise WaitTimeoutError(
+                    f"No free '{self.name}' slot within {self.max_wait_seconds}s, try again later."
+                )
+            finally:
+                self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    def status(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_waiting": self.max_waiting,
+        }
@@ -0,0 +1,213 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import csv  # For the summary file
+import glob  # For expanding input patterns
+import hashlib  # For content hashes of the inputs
+import json  # For the manifest and the hash record
+import os  # For paths and file sizes
+import time  # For timing every map
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+)  # For rendering maps in parallel worker processes
+
+# --- Batch Configuration ---
+# We make one map per WorldPop country and year. This script renders a whole list of them
+# in parallel, skipping maps whose input (and options) haven't changed since the last run.
+HASH_RECORD_FILE_NAME = ".batch_map_hashes.json"  # Kept in the output folder
+SUMMARY_FILE_NAME = "batch_summary.csv"
+SHARED_ASSETS_DIR_NAME = "assets"  # Map JS written once per batch (see CreateMap.write_shared_assets)
+HASH_READ_BLOCK_SIZE = 1 << 20  # Read inputs in 1 MB blocks while hashing
+
+# Every map of a batch loads the same "<output dir>/assets/population_map.js" instead of
+# carrying the cluster / popup JS inline; only its data stays in the HTML.
+# Manifest format (JSON):
+# {
+#     "defaults": {"markerMode": "precluster", "heatmapMode": "density"},   <- shared by all maps
+#     "maps": [
+#         {"csv": "egy_2020_constrained_UNadj.csv", "output": "maps/egy_2020.html"},
+#         {"csv": "btn_2020_constrained_UNadj.csv", "output": "maps/btn_2020.html", "options": {"markerMode": "cluster"}}
+#     ]
+# }
+
+
+def load_manifest(manifestPath):
+    """Read a JSON manifest into a list of jobs {"csv", "output", "options"}."""
+    with open(manifestPath) as manifestFile:
+        manifest = json.load(manifestFile)
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for entry in manifest["maps"]:
+        jobs.append(
+            {
+                "csv": entry["csv"],
+                "output": entry["output"],
+                "options": {**defaults, **entry.get("options", {})},
+            }
+        )
+    return jobs
+
+
+def jobs_from_patterns(patterns, outputDir, options):
+    """Turn glob patterns into jobs writing '<outputDir>/<csv name>.html'."""
+    jobs = []
+    for pattern in patterns:
+        for csvPath in sorted(glob.glob(pattern)):
+            baseName = os.path.splitext(os.path.basename(csvPath))[0]
+            jobs.append(
+                {
+                    "csv": csvPath,
+                    "output": os.path.join(outputDir, f"{baseName}.html"),
+                    "options": dict(options),
+                }
+            )
+    return jobs
+
+
+def content_hash(job):
+    """Hash of the input file contents plus the map options (a changed option re-renders too)."""
+    digest = hashlib.sha256()
+    with open(job["csv"], "rb") as inputFile:
+        for block in iter(lambda: inputFile.read(HASH_READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    digest.update(json.dumps(job["options"], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def folder_size(path):
+    """Total size in bytes of all files below 'path' (0 if it doesn't exist)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def render_map(job):
+    """
+    Render one map in a worker process and report timing and output size.
+    CreateMap is imported once per worker, so folium and its templates are loaded only once.
+    """
+    import CreateMap
+
+    start = time.perf_counter()
+    result = {"csv": job["csv"], "output": job["output"], "status": "ok", "error": ""}
+    try:
+        outputDir = os.path.dirname(job["output"])
+        if outputDir:
+            os.makedirs(outputDir, exist_ok=True)
+        CreateMap.create_map_from_csv(
+            job["csv"], job["output"], sharedAssetsPath=job.get("sharedAssets"), **job["options"]
+        )
+        result["html_bytes"] = os.path.getsize(job["output"])
+        result["popup_bytes"] = folder_size(
+            os.path.splitext(job["output"])[0] + CreateMap.POPUP_DIR_SUFFIX
+        )
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def run_batch(jobs, outputDir, workers=None, force=False):
+    """Render all jobs across a process pool, skipping unchanged ones. Returns the summary rows."""
+    os.makedirs(outputDir, exist_ok=True)
+    hashRecordPath = os.path.join(outputDir, HASH_RECORD_FILE_NAME)
+    hashRecord = {}
+    if os.path.exists(hashRecordPath):
+        with open(hashRecordPath) as hashFile:
+            hashRecord = json.load(hashFile)
+
+    summary = []
+    jobsToRun = []
+    for job in jobs:
+        job["hash"] = content_hash(job)
+        if (
+            not force
+            and hashRecord.get(job["output"]) == job["hash"]
+            and os.path.exists(job["output"])
+        ):
+            print(f"Skipping '{job['output']}' (input unchanged).")
+            summary.append(
+                {
+                    "csv": job["csv"],
+                    "output": job["output"],
+                    "status": "skipped",
+                    "error": "",
+                    "seconds": 0,
+                    "html_bytes": os.path.getsize(job["output"]),
+                }
+            )
+        else:
+            jobsToRun.append(job)
+
+    print(f"{len(jobsToRun)} maps to render, {len(jobs) - len(jobsToRun)} unchanged.")
+    if jobsToRun:
+        import CreateMap
+
+        sharedAssetsPath = CreateMap.write_shared_assets(os.path.join(outputDir, SHARED_ASSETS_DIR_NAME))
+        print(f"Shared map assets written to '{sharedAssetsPath}'.")
+        for job in jobsToRun:
+            job["sharedAssets"] = sharedAssetsPath
+    batchStart = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_map, job): job for job in jobsToRun}
+        for future in as_completed(futures):
+            job = futures[future]
+            result = future.result()
+            summary.append(result)
+            if result["status"] == "ok":
+                hashRecord[job["output"]] = job["hash"]
+                print(
+                    f"Rendered '{result['output']}' in {result['seconds']}s ({result['html_bytes'] / 1e6:.1f} MB)."
+                )
+            else:
+                hashRecord.pop(job["output"], None)
+                print(f"ERROR: '{job['csv']}' failed: {result['error']}")
+
+    with open(hashRecordPath, "w") as hashFile:
+        json.dump(hashRecord, hashFile, indent=2)
+
+    summaryPath = os.path.join(outputDir, SUMMARY_FILE_NAME)
+    with open(summaryPath, "w", newline="") as summaryFile:
+        writer = csv.DictWriter(
+            summaryFile,
+            fieldnames=["csv", "output", "status", "seconds", "html_bytes", "popup_bytes", "error"],
+        )
+        writer.writeheader()
+        writer.writerows(summary)
+    print(
+        f"Batch finished in {time.perf_counter() - batchStart:.2f}s. Summary written to '{summaryPath}'."
+    )
+    return summary
+
+
+# --- Command line entry point ---
+# Examples:
+#   python BatchCreateMap.py --manifest maps.json --output-dir maps
+#   python BatchCreateMap.py "data/*_2020_constrained_UNadj.csv" --output-dir maps --markers precluster
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render many population maps in parallel.")
+    parser.add_argument("patterns", nargs="*", help="Glob patterns of input CSVs")
+    parser.add_argument("--manifest", help="JSON manifest of maps to render")
+    parser.add_argument("--output-dir", default="maps", help="Folder for maps, hashes and summary")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Re-render even if inputs are unchanged")
+    parser.add_argument("--markers", help="Marker mode for pattern inputs (see CreateMap.py)")
+    parser.add_argument("--heatmap", help="Heatmap mode for pattern inputs (see CreateMap.py)")
+    args = parser.parse_args()
+
+    if args.manifest:
+        batchJobs = load_manifest(args.manifest)
+    else:
+        patternOptions = {}
+        if args.markers:
+            patternOptions["markerMode"] = args.markers
+        if args.heatmap:
+            patternOptions["heatmapMode"] = args.heatmap
+        batchJobs = jobs_from_patterns(args.patterns, args.output_dir, patternOptions)
+
+    if not batchJobs:
+        print("No input files found.")
+    else:
+        run_batch(batchJobs, args.output_dir, args.workers, args.force)
@@ -1,125 +1,736 @@
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
 import folium
+import numpy as np
 import pandas as pd
-import tkinter as tk
-import tkinter.filedialog
-from folium.plugins import HeatMap
-
-
-root = tk.Tk()
-root.withdraw()
-csvFileName = tkinter.filedialog.askopenfilename(title = "Please choose the total population file you want :", filetypes= [("csv files", "*.csv"),("All files", "*.*")])
-root.destroy()
-if not csvFileName :
-    print("User didn't select file")
-    exit()
-else : 
-    print(f"User selected file : {csvFileName} ")
+from branca.element import JavascriptLink, MacroElement, Template
+from folium.plugins import FastMarkerCluster, HeatMap
+from Cohorts import NAMED_COHORTS, cohort_weights
+
+
+requiredColumns = ['x', 'y', 'TotalPopulation']
+ageColumnPrefixes = ('f_', 'm_')  # Age/sex columns shown in the popup
+# With a cohort (see Cohorts.py, e.g. "under5" or "f_15..45") the heatmap weights every point by
+# the sum of the cohort's age/sex columns, stored in this column; markers keep showing totals
+cohortWeightColumn = 'CohortPopulation'
+
+# --- Marker modes ---
+# "markers":    one folium.Marker with its own IFrame popup per row (fine for small files only)
+# "cluster":    client-side clustering driven by one compact JS array [[lat, lon, total], ...]
+# "precluster": like "cluster", but for zoom levels up to preClusterMaxZoom the clusters are
+#               computed in Python per zoom level, so the browser only draws a few circles
+# "auto":       "markers" for small files, "cluster" otherwise
+MARKER_MODES = ["auto", "markers", "cluster", "precluster"]
+MARKER_MODE_AUTO_THRESHOLD = 5000  # Above this many points, "auto" switches to "cluster"
+COORDINATE_DECIMALS = 5  # ~1 m precision, keeps the embedded JS array small
+PRECLUSTER_MIN_ZOOM = 3
+PRECLUSTER_MAX_ZOOM = 12
+PRECLUSTER_CELL_PIXELS = 60  # Size of one pre-cluster cell on screen
+
+# --- Heatmap modes ---
+# "density": population is summed into a NumPy grid (optionally smoothed like a KDE) and embedded
+#            as one PNG image overlay, so file size depends on the grid resolution, not the row count
+# "points":  folium HeatMap with every point embedded (the browser runs the kernel over all of them)
+# "none":    no heatmap layer
+HEATMAP_MODES = ["density", "points", "none"]
+DENSITY_GRID_RESOLUTION = 512  # Cells along the longer side of the data extent
+DENSITY_SMOOTHING_CELLS = 2.0  # Gaussian smoothing radius (sigma) in cells, 0 = plain histogram
+# Colour ramp from transparent through blue, lime and yellow to red (similar to Leaflet.heat)
+DENSITY_COLOUR_STOPS = np.array([
+    # position, R, G, B, A
+    [0.00, 0, 0, 255, 0],
+    [0.25, 0, 0, 255, 150],
+    [0.50, 0, 255, 0, 180],
+    [0.75, 255, 255, 0, 200],
+    [1.00, 255, 0, 0, 220],
+])
+
+# --- PostGIS input ---
+# Instead of a CSV, the map can be made straight from a PostGIS population table.
+# Only x/y, TotalPopulation and the age/sex columns are read, filtered by bbox and/or
+# admin polygon inside the database, and streamed to pandas in chunks.
+POSTGIS_GEOM_COL = "geometry"  # Geometry column of the imported population tables
+POSTGIS_CHUNK_SIZE = 50000  # Rows per streamed chunk
+ADMIN_GEOMETRY_COLUMN_NAME = "geom"  # Admin tables from ImportVectorToDatabase
+ADMIN_ID_COLUMN_NAME = "gid"
+
+# --- Lazy popup data ---
+# In the cluster modes the age/sex tables are not inlined in the HTML. They are written as
+# columnar blocks of POPUP_BLOCK_SIZE rows to a "<map name>_popups" folder next to the HTML,
+# and a marker loads the block holding its row (by point id) when it is clicked.
+# Blocks are small .js files added with a <script> tag, so this also works for maps opened
+# straight from disk (file://), where fetch() of local files is blocked.
+POPUP_BLOCK_SIZE = 5000
+POPUP_DIR_SUFFIX = "_popups"
+
+# JS callback turning one row of the compact data array into a marker
+FAST_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip('Total population : ' + row[2]);
+    marker.bindPopup('<b> Position : </b> (' + row[0].toFixed(4) + ', ' + row[1].toFixed(4) + ')<br> '
+        + '<b>TotalPopulation:</b> ' + row[2] + '<br>');
+    return marker;
+};
+"""
+
+
+# Same as above, but the popup's age/sex table is loaded from the sidecar on click (row[3] = point id)
+LAZY_POPUP_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip('Total population : ' + row[2]);
+    var header = '<b> Position : </b> (' + row[0].toFixed(4) + ', ' + row[1].toFixed(4) + ')<br> '
+        + '<b>TotalPopulation:</b> ' + row[2] + '<br>';
+    marker.bindPopup(header + '<i>Loading age data...</i>', {maxHeight: 250});
+    marker.on('click', function () {
+        loadPopulationPopup(row[3], function (block, offset) {
+            var html = header + '<hr><b>Age Data with Gender:</b><br>';
+            for (var c = 0; c < block.columns.length; c++) {
+                var value = block.values[c][offset];
+                html += '<b>' + block.columns[c] + ':</b> ' + (value === null ? 'N/A' : value) + '<br>';
+            }
+            marker.setPopupContent(html);
+        });
+    });
+    return marker;
+};
+"""
+
+
+# Defines loadPopulationPopup(id, callback), which loads popup blocks from the sidecar on demand
+LAZY_POPUP_LOADER_FUNCTION = """
+function initLazyPopupLoader(baseUrl, blockSize) {
+    var blocks = {};
+    var pending = {};
+    window.populationPopupBlockLoaded = function (index, block) {
+        blocks[index] = block;
+        (pending[index] || []).forEach(function (callback) { callback(block); });
+        delete pending[index];
+    };
+    window.loadPopulationPopup = function (id, callback) {
+        var index = Math.floor(id / blockSize);
+        var done = function (block) { callback(block, id - index * blockSize); };
+        if (blocks[index]) { done(blocks[index]); return; }
+        if (pending[index]) { pending[index].push(done); return; }
+        pending[index] = [done];
+        var script = document.createElement('script');
+        script.src = baseUrl + '/block_' + index + '.js';
+        document.head.appendChild(script);
+    };
+}
+"""
+
+
+# Draws the pre-computed clusters of the current zoom level (only those inside the view)
+# and hands over to the client-side cluster layer when zooming in past maxZoom
+PRECLUSTERED_LAYER_FUNCTION = """
+function initPreClusteredLayer(map, rawLayer, levels, minZoom, maxZoom) {
+    var clusterLayer = L.layerGroup();
+    function render() {
+        var zoom = map.getZoom();
+        clusterLayer.clearLayers();
+        if (zoom > maxZoom) {
+            map.removeLayer(clusterLayer);
+            if (!map.hasLayer(rawLayer)) { map.addLayer(rawLayer); }
+            return;
+        }
+        if (map.hasLayer(rawLayer)) { map.removeLayer(rawLayer); }
+        var bounds = map.getBounds().pad(0.5);
+        var cells = levels[Math.max(zoom, minZoom)];
+        for (var i = 0; i < cells.length; i++) {
+            var c = cells[i];
+            if (!bounds.contains([c[0], c[1]])) { continue; }
+            L.circleMarker([c[0], c[1]], {
+                radius: 6 + 3 * Math.log10(c[3]),
+                color: '#b30000', weight: 1, fillOpacity: 0.6
+            }).bindTooltip('Total population : ' + c[2] + ' (' + c[3] + ' points)')
+              .addTo(clusterLayer);
+        }
+        clusterLayer.addTo(map);
+    }
+    map.on('moveend', render);
+    render();
+}
+"""
+
+
+# --- Shared assets ---
+# The JS above is the same in every map. A single map carries it inline. A batch of maps
+# (see BatchCreateMap.py) writes it once to SHARED_ASSETS_FILE_NAME, and every map loads
+# that file and only carries its own data and the calls.
+SHARED_ASSETS_FILE_NAME = "population_map.js"
+SHARED_FAST_MARKER_CALLBACK = "populationFastMarker"
+SHARED_LAZY_POPUP_MARKER_CALLBACK = "populationLazyMarker"
+
+
+def shared_assets_js():
+    """Content of the shared asset file: the marker callbacks and the two layer functions."""
+    return "\n".join([
+        f"var {SHARED_FAST_MARKER_CALLBACK} = {FAST_MARKER_CALLBACK.strip()}",
+        f"var {SHARED_LAZY_POPUP_MARKER_CALLBACK} = {LAZY_POPUP_MARKER_CALLBACK.strip()}",
+        LAZY_POPUP_LOADER_FUNCTION,
+        PRECLUSTERED_LAYER_FUNCTION,
+    ])
+
+
+def write_shared_assets(assetDir):
+    """Write the shared asset file to assetDir and return its path."""
+    os.makedirs(assetDir, exist_ok=True)
+    assetPath = os.path.join(assetDir, SHARED_ASSETS_FILE_NAME)
+    with open(assetPath, "w") as assetFile:
+        assetFile.write(shared_assets_js())
+    return assetPath
+
+
+class LazyPopupLoader(MacroElement):
+    """Sets up loadPopulationPopup for this map (see LAZY_POPUP_LOADER_FUNCTION)."""
 
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            {{ this.definition }}
+            initLazyPopupLoader({{ this.baseUrlJson }}, {{ this.blockSize }});
+        })();
+        {% endmacro %}
+    """)
 
+    def __init__(self, baseUrl, blockSize=POPUP_BLOCK_SIZE, sharedAssets=False):
+        super().__init__()
+        self._name = 'LazyPopupLoader'
+        self.baseUrlJson = json.dumps(baseUrl)
+        self.blockSize = blockSize
+        self.definition = "" if sharedAssets else LAZY_POPUP_LOADER_FUNCTION
 
-#csvFileName = 'btn_2020_constrained_UNadj.csv'
-df = None
 
-try :
+class PreClusteredLayer(MacroElement):
+    """Adds the pre-computed cluster levels to this map (see PRECLUSTERED_LAYER_FUNCTION)."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            {{ this.definition }}
+            initPreClusteredLayer({{ this._parent.get_name() }}, {{ this.rawLayerName }}, {{ this.levelsJson }}, {{ this.minZoom }}, {{ this.maxZoom }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, rawLayer, levels, minZoom, maxZoom, sharedAssets=False):
+        super().__init__()
+        self._name = 'PreClusteredLayer'
+        self.rawLayerName = rawLayer.get_name()
+        self.levelsJson = json.dumps(levels, separators=(',', ':'))
+        self.minZoom = minZoom
+        self.maxZoom = maxZoom
+        self.definition = "" if sharedAssets else PRECLUSTERED_LAYER_FUNCTION
+
+
+@contextmanager
+def timed_stage(stageName, timings):
+    """Time one stage of the map creation and print how long it took."""
+    stageStart = time.perf_counter()
+    yield
+    timings[stageName] = time.perf_counter() - stageStart
+    print(f"[{stageName}] {timings[stageName]:.2f}s")
+
+
+def load_population_csv(csvFileName):
+    """Read and validate a population CSV. Raises ValueError if it is empty or misses columns."""
     df = pd.read_csv(csvFileName)
     print("File Load Successful.")
 
-except FileNotFoundError :
-    print(f"File '{csvFileName}' Not found")
-    exit()
+    #Check if file is empty
+    if df is None or df.empty:
+        raise ValueError(f"File '{csvFileName}' read was Empty!")
 
-except pd.errors.EmptyDataError :
-    print(f"Error, file '{csvFileName}' read was Empty!")
-    exit()
+    missingCols = [col for col in requiredColumns if col not in df.columns]
+    if missingCols:
+        raise ValueError(f"Missing required columns: {missingCols}")
+    print("All required fields exist!")
+    return df
 
-except pd.errors.ParserError:
-    print(f"Error: Could not parse file '{csvFileName}'. Check format.")
-    exit()
 
-except Exception as e :
-    print(f"An unexpected error occurred while reading the CSV: {e}")
-    exit()
+def build_postgis_query(tableName, ageColumns, bbox=None, adminTable=None, adminId=None, sampleCellDegrees=None, samplePerCell=1, aggregateCellDegrees=None):
+    """
+    Build the SQL (and its parameters) reading population points from PostGIS.
+    - bbox=(west, south, east, north) and/or adminTable+adminId restrict the area (index-assisted)
+    - sampleCellDegrees: stratified spatial sample, at most samplePerCell random points per grid cell
+    - aggregateCellDegrees: pre-aggregate to one point per grid cell (summed population, mean position)
+    """
+    params = {}
+    conditions = []
+    if bbox:
+        conditions.append(f"p.{POSTGIS_GEOM_COL} && ST_MakeEnvelope(:west, :south, :east, :north, 4326)")
+        params.update(dict(zip(["west", "south", "east", "north"], bbox)))
+    if adminTable:
+        # The subdivided copy keeps point-in-polygon tests on small, index-friendly pieces
+        from ImportVectorToDatabase import subdivided_table_name
 
+        conditions.append(
+            f'EXISTS (SELECT 1 FROM public."{subdivided_table_name(adminTable)}" a '
+            f'WHERE a."{ADMIN_ID_COLUMN_NAME}" = :admin_id AND ST_Intersects(a.{ADMIN_GEOMETRY_COLUMN_NAME}, p.{POSTGIS_GEOM_COL}))'
+        )
+        params["admin_id"] = adminId
+    whereClause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-#Check if file is empty
-if  df is None or df.empty :
-    print("Error, Data frame could not loaded or was Empty!")
-    exit()
+    pointColumns = [f'ST_X(p.{POSTGIS_GEOM_COL}) AS x', f'ST_Y(p.{POSTGIS_GEOM_COL}) AS y', 'p."TotalPopulation"']
+    pointColumns += [f'p."{colName}"' for colName in ageColumns]
+    selectList = ", ".join(pointColumns)
+
+    if aggregateCellDegrees:
+        params["cell"] = aggregateCellDegrees
+        sums = ", ".join(f'SUM("{colName}") AS "{colName}"' for colName in ["TotalPopulation"] + ageColumns)
+        sql = f"""
+            SELECT AVG(x) AS x, AVG(y) AS y, {sums}, COUNT(*) AS point_count
+            FROM (SELECT {selectList} FROM public."{tableName}" p {whereClause}) points
+            GROUP BY FLOOR(x / :cell), FLOOR(y / :cell)
+        """
+    elif sampleCellDegrees:
+        params["cell"] = sampleCellDegrees
+        params["per_cell"] = samplePerCell
+        outerColumns = ", ".join(['x', 'y', '"TotalPopulation"'] + [f'"{colName}"' for colName in ageColumns])
+        sql = f"""
+            SELECT {outerColumns} FROM (
+                SELECT points.*,
+                       ROW_NUMBER() OVER (PARTITION BY FLOOR(x / :cell), FLOOR(y / :cell) ORDER BY random()) AS cell_rank
+                FROM (SELECT {selectList} FROM public."{tableName}" p {whereClause}) points
+            ) ranked
+            WHERE cell_rank <= :per_cell
+        """
+    else:
+        sql = f'SELECT {selectList} FROM public."{tableName}" p {whereClause}'
+    return sql, params
 
-requiredColumns =  ['x', 'y', 'TotalPopulation']
-allColumnPresent = all (col in df.columns for col in requiredColumns)
-if allColumnPresent :
-    print ("All required fields exist!")
-else:
-    print ("Error: Missing required columns!")
-    missingCols = [col for col in requiredColumns if col not in df.columns]
-    print(f"Missing columns: {missingCols}")
-    exit()
 
-#Create Base Map
-mapCenter = [df['y'].mean(), df['x'].mean()]
-baseMap = folium.Map(location = mapCenter, zoom_start = 10)
-print("Base map created successfully.")
+def load_population_postgis(databaseConnectionString, tableName, includeAgeColumns=True, chunkSize=POSTGIS_CHUNK_SIZE, **queryOptions):
+    """
+    Read population points for the map straight from PostGIS, streamed in chunks.
+    queryOptions are passed on to build_postgis_query (bbox, adminTable, sampling, ...).
+    """
+    from sqlalchemy import create_engine, text  # Only needed for PostGIS input, CSV maps skip it
+
+    engine = create_engine(databaseConnectionString)
+    try:
+        with engine.connect() as connection:
+            ageColumns = []
+            if includeAgeColumns:
+                tableColumns = connection.execute(
+                    text("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = :table ORDER BY ordinal_position"),
+                    {"table": tableName},
+                ).scalars().all()
+                ageColumns = [colName for colName in tableColumns if colName.startswith(ageColumnPrefixes)]
 
-#Create HeatMap
-print("Preparing heatmap data...")
-heatData = df[['y', 'x', 'TotalPopulation']].values.tolist()
-print("Adding heatmap layer...")
-newHeatMap = folium.plugins.HeatMap(data=heatData, radius=15, blur=10, name='Population HeatMap')
-newHeatMap.add_to(baseMap)
+            sql, params = build_postgis_query(tableName, ageColumns, **queryOptions)
+            # stream_results uses a server-side cursor, so only one chunk is held in memory at a time
+            streamingConnection = connection.execution_options(stream_results=True)
+            chunks = []
+            for chunk in pd.read_sql(text(sql), streamingConnection, params=params, chunksize=chunkSize):
+                chunks.append(chunk)
+                print(f"Read {sum(len(c) for c in chunks)} rows from 'public.{tableName}'...")
+    finally:
+        engine.dispose()
 
-# Add markers on map
+    if not chunks:
+        raise ValueError(f"No population data found in 'public.{tableName}' for this area.")
+    df = pd.concat(chunks, ignore_index=True)
+    if df.empty:
+        raise ValueError(f"No population data found in 'public.{tableName}' for this area.")
+    return df
 
-markerGroup = folium.FeatureGroup(name='Population Markers')
 
-for index, row in df.iterrows() :
-    lon = row['x']
-    lat = row['y']
+def build_popup_html(df):
+    """
+    Build the popup HTML of every row in one vectorized pass.
+    The age/sex columns are resolved once and formatted column by column,
+    instead of scanning df.columns and concatenating strings for every row.
+    """
+    ageColumns = [colName for colName in df.columns if colName.startswith(ageColumnPrefixes)]
 
-    #Create html contents
-    htmlContent = f"<b> Position : </b> ({lat:.4f}, {lon:.4f})<br> "
-    htmlContent += f"<b>TotalPopulation:</b> {row['TotalPopulation']}<br>"
-    htmlContent += "<hr><b>Age Data with Gender:</b><br>"
+    htmlContent = (
+        "<b> Position : </b> ("
+        + df['y'].map("{:.4f}".format)
+        + ", "
+        + df['x'].map("{:.4f}".format)
+        + ")<br> "
+        + "<b>TotalPopulation:</b> "
+        + df['TotalPopulation'].astype(str)
+        + "<br>"
+        + "<hr><b>Age Data with Gender:</b><br>"
+    )
     #dynamicly shows the column name
-    for colName in df.columns : 
-        if colName.startswith(('f_' , 'm_')) : 
-            value = row[colName]
-            if pd.notna(value):
-                htmlContent += f"<b>{colName}:</b> {value}<br>" 
-            else:
-                htmlContent += f"<b>{colName}:</b> N/A<br>" 
-    
-    #Create the iframe
-    iframe = folium.IFrame(html= htmlContent, width=200, height=250)
-
-    #Create popup object
-    popup = folium.Popup(iframe, max_width = 200)
-
-    marker = folium.Marker(location=[lat, lon], popup = popup, tooltip=f"Total population : {row['TotalPopulation']}")
-    marker.add_to(markerGroup) 
-
-#Add Marker to map group    
-markerGroup.add_to(baseMap)
-print("Markers added to the map.") 
-
-#Create layer control
-print("Adding layer control...")
-folium.LayerControl().add_to(baseMap)
-
-#Save base map 
-
-
-root = tk.Tk()
-root.withdraw()
-htmlFileSavePath = tkinter.filedialog.asksaveasfilename(title= "Choose Your save directory: ", initialfile='webMapData.html',defaultextension=".html", filetypes=[("HTML files","*.html"), ("All files","*.*")])
-root.destroy()
-if not htmlFileSavePath :
-    print ("User cancel save option")
-else:
-    try:
+    for colName in ageColumns:
+        values = df[colName].astype(str).where(df[colName].notna(), "N/A")
+        htmlContent = htmlContent + f"<b>{colName}:</b> " + values + "<br>"
+    return htmlContent
+
+
+def weight_column(df):
+    """Column the heatmap is weighted by: the cohort if one was chosen."""
+    return cohortWeightColumn if cohortWeightColumn in df.columns else 'TotalPopulation'
+
+
+def build_tooltips(df):
+    """Tooltip text of every row, built column-wise."""
+    return "Total population : " + df['TotalPopulation'].astype(str)
+
+
+def build_density_grid(df, resolution=DENSITY_GRID_RESOLUTION, smoothingCells=DENSITY_SMOOTHING_CELLS):
+    """
+    Sum population into a regular lon/lat grid with a weighted 2D histogram.
+    With smoothingCells > 0 the grid is blurred with a separable Gaussian kernel (a gridded KDE).
+    Returns (grid with row 0 = south, [[south, west], [north, east]]).
+    """
+    lon = df['x'].to_numpy(dtype='float64')
+    lat = df['y'].to_numpy(dtype='float64')
+    population = df[weight_column(df)].fillna(0).to_numpy(dtype='float64')
+
+    west, east = lon.min(), lon.max()
+    south, north = lat.min(), lat.max()
+    span = max(east - west, north - south, 1e-6)
+    cellSize = span / resolution
+    # Pad by a few cells so the smoothed edges aren't cut off
+    padding = cellSize * (3 * smoothingCells + 1)
+    west, east, south, north = west - padding, east + padding, south - padding, north + padding
+    columns = max(int(np.ceil((east - west) / cellSize)), 1)
+    rows = max(int(np.ceil((north - south) / cellSize)), 1)
+
+    grid, _, _ = np.histogram2d(lat, lon, bins=[rows, columns], range=[[south, north], [west, east]], weights=population)
+
+    if smoothingCells > 0:
+        radius = int(np.ceil(3 * smoothingCells))
+        offsets = np.arange(-radius, radius + 1)
+        kernel = np.exp(-0.5 * (offsets / smoothingCells) ** 2)
+        kernel /= kernel.sum()
+        grid = np.apply_along_axis(np.convolve, 0, grid, kernel, mode='same')
+        grid = np.apply_along_axis(np.convolve, 1, grid, kernel, mode='same')
+
+    return grid, [[float(south), float(west)], [float(north), float(east)]]
+
+
+def colorize_density_grid(grid):
+    """Turn a density grid into an RGBA image (row 0 = north) using a log-scaled colour ramp."""
+    maxValue = grid.max()
+    normalized = np.log1p(grid) / np.log1p(maxValue) if maxValue > 0 else np.zeros_like(grid)
+    image = np.zeros(grid.shape + (4,), dtype='uint8')
+    for channel in range(4):
+        image[..., channel] = np.interp(normalized, DENSITY_COLOUR_STOPS[:, 0], DENSITY_COLOUR_STOPS[:, channel + 1])
+    image[grid <= 0] = 0  # Empty cells stay fully transparent
+    return np.flipud(image)
+
+
+def add_heatmap(df, baseMap, heatmapMode, densityResolution):
+    """Add the population heatmap layer in the chosen mode."""
+    if heatmapMode == "points":
+        heatData = df[['y', 'x', weight_column(df)]].values.tolist()
+        HeatMap(data=heatData, radius=15, blur=10, name='Population HeatMap').add_to(baseMap)
+    elif heatmapMode == "density":
+        grid, bounds = build_density_grid(df, densityResolution)
+        print(f"Density grid: {grid.shape[1]} x {grid.shape[0]} cells.")
+        folium.raster_layers.ImageOverlay(
+            image=colorize_density_grid(grid),
+            bounds=bounds,
+            mercator_project=True,  # Grid is in lon/lat, the map is Web Mercator
+            name='Population HeatMap',
+        ).add_to(baseMap)
+
+
+def build_marker_data(df, withIds=False):
+    """
+    Compact [[lat, lon, total], ...] array for the client-side cluster layer.
+    With withIds, every row also gets its point id (row position) for the lazy popups.
+    """
+    columns = [
+        df['y'].round(COORDINATE_DECIMALS).to_numpy(),
+        df['x'].round(COORDINATE_DECIMALS).to_numpy(),
+        df['TotalPopulation'].round(2).to_numpy(),
+    ]
+    if withIds:
+        columns.append(np.arange(len(df)))
+    return np.column_stack(columns).tolist()
+
+
+def write_popup_sidecar(df, popupDir, blockSize=POPUP_BLOCK_SIZE):
+    """
+    Write the age/sex columns as columnar blocks of blockSize rows:
+    popupDir/block_<n>.js -> populationPopupBlockLoaded(n, {"columns": [...], "values": [[...], ...]});
+    Row i of the DataFrame is row (i % blockSize) of block (i // blockSize).
+    """
+    os.makedirs(popupDir, exist_ok=True)
+    ageColumns = [colName for colName in df.columns if colName.startswith(ageColumnPrefixes)]
+    ageData = df[ageColumns].round(2)
+    totalBytes = 0
+    for blockIndex, start in enumerate(range(0, len(df), blockSize)):
+        block = ageData.iloc[start:start + blockSize]
+        values = [block[colName].astype(object).where(block[colName].notna(), None).tolist() for colName in ageColumns]
+        content = f"populationPopupBlockLoaded({blockIndex}, {json.dumps({'columns': ageColumns, 'values': values}, separators=(',', ':'))});"
+        with open(os.path.join(popupDir, f"block_{blockIndex}.js"), "w") as blockFile:
+            blockFile.write(content)
+        totalBytes += len(content)
+    print(f"Popup data written to '{popupDir}' ({totalBytes / 1e6:.1f} MB).")
+
+
+def precluster_points(df, minZoom=PRECLUSTER_MIN_ZOOM, maxZoom=PRECLUSTER_MAX_ZOOM, cellPixels=PRECLUSTER_CELL_PIXELS):
+    """
+    Pre-cluster the points for every zoom level with NumPy.
+    Points are binned into square cells about cellPixels wide on screen; every cell becomes
+    [mean lat, mean lon, total population, point count].
+    Returns {zoom: [[lat, lon, total, count], ...]}.
+    """
+    lat = df['y'].to_numpy(dtype='float64')
+    lon = df['x'].to_numpy(dtype='float64')
+    population = df['TotalPopulation'].fillna(0).to_numpy(dtype='float64')
+    levels = {}
+    for zoom in range(minZoom, maxZoom + 1):
+        cellDegrees = 360.0 / (2 ** zoom) / 256 * cellPixels
+        cellX = np.floor(lon / cellDegrees).astype('int64')
+        cellY = np.floor(lat / cellDegrees).astype('int64')
+        _, cellIndex = np.unique(np.column_stack([cellX, cellY]), axis=0, return_inverse=True)
+        cellIndex = cellIndex.ravel()
+        counts = np.bincount(cellIndex)
+        levels[zoom] = np.column_stack([
+            np.round(np.bincount(cellIndex, weights=lat) / counts, COORDINATE_DECIMALS),
+            np.round(np.bincount(cellIndex, weights=lon) / counts, COORDINATE_DECIMALS),
+            np.round(np.bincount(cellIndex, weights=population)),
+            counts,
+        ]).tolist()
+        print(f"Zoom {zoom}: {len(counts)} pre-clusters.")
+    return levels
+
+
+def add_popup_markers(df, baseMap, timings):
+    """Markers mode: one folium.Marker with an IFrame popup per row."""
+    # Create html contents for all markers at once
+    with timed_stage("popup content", timings):
+        popupHtml = build_popup_html(df)
+        tooltips = build_tooltips(df)
+
+    # Add markers on map
+    with timed_stage("markers", timings):
+        markerGroup = folium.FeatureGroup(name='Population Markers')
+        for lat, lon, htmlContent, tooltip in zip(df['y'], df['x'], popupHtml, tooltips):
+            #Create the iframe
+            iframe = folium.IFrame(html=htmlContent, width=200, height=250)
+            #Create popup object
+            popup = folium.Popup(iframe, max_width=200)
+            folium.Marker(location=[lat, lon], popup=popup, tooltip=tooltip).add_to(markerGroup)
+        #Add Marker to map group
+        markerGroup.add_to(baseMap)
+
+
+def add_clustered_markers(df, baseMap, timings, preCluster=False, preClusterMaxZoom=PRECLUSTER_MAX_ZOOM, popupDir=None, sharedAssetsUrl=None):
+    """
+    Cluster / precluster modes: one JS data array instead of one Python object per point.
+    With popupDir, the age/sex popup data is written there and loaded on click.
+    With sharedAssetsUrl, the map loads the shared asset file instead of carrying its JS inline.
+    """
+    sharedAssets = bool(sharedAssetsUrl)
+    if sharedAssets:
+        baseMap.get_root().header.add_child(JavascriptLink(sharedAssetsUrl), name='population_map_assets')
+
+    if popupDir:
+        with timed_stage("popup sidecar", timings):
+            write_popup_sidecar(df, popupDir)
+            baseMap.add_child(LazyPopupLoader(os.path.basename(popupDir), sharedAssets=sharedAssets))
+
+    with timed_stage("marker data", timings):
+        markerData = build_marker_data(df, withIds=bool(popupDir))
+        if sharedAssets:
+            callback = SHARED_LAZY_POPUP_MARKER_CALLBACK if popupDir else SHARED_FAST_MARKER_CALLBACK
+        else:
+            callback = LAZY_POPUP_MARKER_CALLBACK if popupDir else FAST_MARKER_CALLBACK
+        clusterLayer = FastMarkerCluster(data=markerData, callback=callback, name='Population Markers')
+        clusterLayer.add_to(baseMap)
+
+    if preCluster and preClusterMaxZoom < PRECLUSTER_MIN_ZOOM:
+        # No level to pre-cluster: the client-side cluster layer handles every zoom
+        print(f"Pre-clustering skipped: preClusterMaxZoom {preClusterMaxZoom} is below {PRECLUSTER_MIN_ZOOM}.")
+    elif preCluster:
+        with timed_stage("pre-clustering", timings):
+            levels = precluster_points(df, maxZoom=preClusterMaxZoom)
+            baseMap.add_child(PreClusteredLayer(clusterLayer, levels, PRECLUSTER_MIN_ZOOM, preClusterMaxZoom, sharedAssets=sharedAssets))
+
+
+def create_map(df, timings=None, markerMode="auto", preClusterMaxZoom=PRECLUSTER_MAX_ZOOM, heatmapMode="density", densityResolution=DENSITY_GRID_RESOLUTION, popupDir=None, cohort=None, sharedAssetsUrl=None):
+    """
+    Build the folium map (heatmap + population markers) for a population DataFrame.
+    popupDir: folder (next to the saved HTML) for lazily loaded popup data in the cluster modes.
+    sharedAssetsUrl: URL of a shared asset file (write_shared_assets) to load instead of inline JS.
+    cohort: cohort expression to weight the heatmap by instead of TotalPopulation.
+    """
+    timings = {} if timings is None else timings
+    if cohort:
+        with timed_stage("cohort weights", timings):
+            df = df.assign(**{cohortWeightColumn: cohort_weights(df, cohort)})
+        print(f"Cohort '{cohort}': {df[cohortWeightColumn].sum():.0f} people.")
+    if markerMode == "auto":
+        markerMode = "markers" if len(df) <= MARKER_MODE_AUTO_THRESHOLD else "cluster"
+    print(f"Marker mode: {markerMode}")
+
+    #Create Base Map
+    with timed_stage("base map", timings):
+        mapCenter = [df['y'].mean(), df['x'].mean()]
+        baseMap = folium.Map(location = mapCenter, zoom_start = 10)
+
+    #Create HeatMap
+    with timed_stage("heatmap", timings):
+        add_heatmap(df, baseMap, heatmapMode, densityResolution)
+
+    if markerMode == "markers":
+        add_popup_markers(df, baseMap, timings)
+    else:
+        add_clustered_markers(df, baseMap, timings, preCluster=(markerMode == "precluster"), preClusterMaxZoom=preClusterMaxZoom, popupDir=popupDir, sharedAssetsUrl=sharedAssetsUrl)
+
+    #Create layer control
+    folium.LayerControl().add_to(baseMap)
+    return baseMap
+
+
+def create_map_from_csv(csvFileName, htmlFileSavePath, lazyPopups=True, sharedAssetsPath=None, **mapOptions):
+    """
+    Headless entry point: read a population CSV, build the map and save it as HTML.
+    mapOptions are passed on to create_map (markerMode, heatmapMode, ...).
+    With lazyPopups, popup data goes to a "<html name>_popups" folder next to the HTML.
+    With sharedAssetsPath (see write_shared_assets), the map references that file for its JS.
+    Returns a dict with the time (seconds) spent in every stage.
+    """
+    timings = {}
+    with timed_stage("read csv", timings):
+        df = load_population_csv(csvFileName)
+    print(f"Loaded {len(df)} rows from '{csvFileName}'.")
+    return save_map(df, htmlFileSavePath, timings, lazyPopups, sharedAssetsPath, **mapOptions)
+
+
+def create_map_from_postgis(databaseConnectionString, tableName, htmlFileSavePath, lazyPopups=True, queryOptions=None, sharedAssetsPath=None, **mapOptions):
+    """
+    Headless entry point reading from a PostGIS table instead of a CSV.
+    queryOptions: bbox / adminTable+adminId / sampling or aggregation (see build_postgis_query).
+    Returns a dict with the time (seconds) spent in every stage.
+    """
+    timings = {}
+    with timed_stage("read postgis", timings):
+        df = load_population_postgis(databaseConnectionString, tableName, **(queryOptions or {}))
+    print(f"Loaded {len(df)} rows from 'public.{tableName}'.")
+    return save_map(df, htmlFileSavePath, timings, lazyPopups, sharedAssetsPath, **mapOptions)
+
+
+def save_map(df, htmlFileSavePath, timings, lazyPopups=True, sharedAssetsPath=None, **mapOptions):
+    """Build the map for df and save it (plus popup sidecar) as HTML."""
+    popupDir = os.path.splitext(htmlFileSavePath)[0] + POPUP_DIR_SUFFIX if lazyPopups else None
+    sharedAssetsUrl = None
+    if sharedAssetsPath:
+        # Relative to the HTML, so the folder can be moved or served as a whole
+        htmlDir = os.path.dirname(os.path.abspath(htmlFileSavePath))
+        sharedAssetsUrl = os.path.relpath(os.path.abspath(sharedAssetsPath), htmlDir).replace(os.sep, '/')
+    baseMap = create_map(df, timings, popupDir=popupDir, sharedAssetsUrl=sharedAssetsUrl, **mapOptions)
+
+    #Save base map
+    with timed_stage("save html", timings):
         baseMap.save(htmlFileSavePath)
-        print(f"Map successfully saved to: {htmlFileSavePath}")
-    except Exception as e:
-        print(f"Error saving map to {htmlFileSavePath}: {e}")
+    print(f"Map successfully saved to: {htmlFileSavePath}")
+    print(f"Total: {sum(timings.values()):.2f}s")
+    return timings
+
 
+def precluster_max_zoom(value):
+    """argparse type for --precluster-max-zoom: at least PRECLUSTER_MIN_ZOOM."""
+    zoom = int(value)
+    if zoom < PRECLUSTER_MIN_ZOOM:
+        raise argparse.ArgumentTypeError(f"must be at least {PRECLUSTER_MIN_ZOOM} (the first pre-clustered zoom level)")
+    return zoom
 
+
+def ask_paths_with_dialogs():
+    """Interactive mode: choose the input CSV and the output HTML with tkinter dialogs."""
+    import tkinter as tk
+    import tkinter.filedialog
+
+    root = tk.Tk()
+    root.withdraw()
+    csvFileName = tkinter.filedialog.askopenfilename(title = "Please choose the total population file you want :", filetypes= [("csv files", "*.csv"),("All files", "*.*")])
+    if not csvFileName:
+        root.destroy()
+        print("User didn't select file")
+        return None, None
+    print(f"User selected file : {csvFileName} ")
+    htmlFileSavePath = tkinter.filedialog.asksaveasfilename(title= "Choose Your save directory: ", initialfile='webMapData.html',defaultextension=".html", filetypes=[("HTML files","*.html"), ("All files","*.*")])
+    root.destroy()
+    if not htmlFileSavePath:
+        print ("User cancel save option")
+        return None, None
+    return csvFileName, htmlFileSavePath
+
+
+# --- Entry point ---
+# Headless:    python CreateMap.py btn_2020_constrained_UNadj.csv -o webMapData.html
+# PostGIS:     python CreateMap.py --db "postgresql://..." --table egy_2020_constrained_UNadj --bbox 31,29.8,31.5,30.2
+# Interactive: python CreateMap.py   (file dialogs)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a population web map from a CSV file or a PostGIS table.")
+    parser.add_argument("csv", nargs="?", help="Population CSV (omit to choose with a file dialog)")
+    parser.add_argument("-o", "--output", default="webMapData.html", help="Output HTML file")
+    parser.add_argument("--markers", choices=MARKER_MODES, default="auto", help="Marker rendering mode")
+    parser.add_argument("--precluster-max-zoom", type=precluster_max_zoom, default=PRECLUSTER_MAX_ZOOM, help="Last zoom level drawn from pre-computed clusters")
+    parser.add_argument("--inline-popups", action="store_true", help="Don't write popup data to a sidecar folder")
+    parser.add_argument("--heatmap", choices=HEATMAP_MODES, default="density", help="Heatmap rendering mode")
+    parser.add_argument("--density-resolution", type=int, default=DENSITY_GRID_RESOLUTION, help="Density grid cells along the longer side")
+    parser.add_argument("--cohort", help=f"Weight the heatmap by a cohort instead of TotalPopulation: one of {sorted(NAMED_COHORTS)}, or e.g. f_0+m_0, f_15..45, *_65..80")
+    parser.add_argument("--db", help="Database connection string (read from PostGIS instead of a CSV)")
+    parser.add_argument("--table", help="PostGIS population table")
+    parser.add_argument("--bbox", help="Only this area: west,south,east,north")
+    parser.add_argument("--admin-table", help="Only points inside an admin polygon of this table (needs its _subdivided copy)")
+    parser.add_argument("--admin-id", type=int, help="gid of the admin polygon")
+    parser.add_argument("--sample-cell", type=float, help="Stratified sample: grid cell size in degrees")
+    parser.add_argument("--sample-per-cell", type=int, default=1, help="Stratified sample: points kept per cell")
+    parser.add_argument("--aggregate-cell", type=float, help="Pre-aggregate to one point per grid cell of this size in degrees")
+    args = parser.parse_args()
+
+    mapOptions = dict(
+        lazyPopups=not args.inline_popups,
+        markerMode=args.markers,
+        preClusterMaxZoom=args.precluster_max_zoom,
+        heatmapMode=args.heatmap,
+        densityResolution=args.density_resolution,
+        cohort=args.cohort,
+    )
+
+    if args.db and args.table:
+        queryOptions = dict(
+            bbox=[float(value) for value in args.bbox.split(",")] if args.bbox else None,
+            adminTable=args.admin_table,
+            adminId=args.admin_id,
+            sampleCellDegrees=args.sample_cell,
+            samplePerCell=args.sample_per_cell,
+            aggregateCellDegrees=args.aggregate_cell,
+        )
+        try:
+            create_map_from_postgis(args.db, args.table, args.output, queryOptions=queryOptions, **mapOptions)
+        except Exception as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        sys.exit()
+
+    if args.csv:
+        csvFileName, htmlFileSavePath = args.csv, args.output
+    else:
+        csvFileName, htmlFileSavePath = ask_paths_with_dialogs()
+        if not csvFileName:
+            sys.exit()
+
+    try:
+        create_map_from_csv(csvFileName, htmlFileSavePath, **mapOptions)
+    except FileNotFoundError:
+        print(f"File '{csvFileName}' Not found")
+        sys.exit(1)
+    except pd.errors.EmptyDataError:
+        print(f"Error, file '{csvFileName}' read was Empty!")
+        sys.exit(1)
+    except pd.errors.ParserError:
+        print(f"Error: Could not parse file '{csvFileName}'. Check format.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
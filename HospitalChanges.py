@@ -0,0 +1,277 @@
+# Import necessary libraries
+import asyncio  # For the per-client queues and heartbeats
+import json  # For the event payloads
+from sqlalchemy import text  # For executing plain SQL
+
+# --- Hospital Change Feed Configuration ---
+# Instead of refetching /get_hospitals, clients keep one Server-Sent Events stream open and
+# receive every inserted, updated or deleted hospital as a small delta.
+# A trigger on public.hospitals writes each change to public.hospital_changes, together with
+# the id of the writing transaction, so changes made by any API worker (or directly in the
+# database) end up in one log. Every worker polls the log once per CHANGE_POLL_SECONDS and
+# fans new rows out to its clients. A reconnecting client sends the cursor of the last change
+# it saw (the SSE Last-Event-ID header) and first gets everything after it from the log.
+#
+# The cursor is "<txid>:<seq>" and changes are handed out in seq order. A plain sequence can
+# hand a lower seq to a transaction that commits after one with a higher seq, which a client
+# that already moved past it would skip. So the trigger takes an exclusive transaction lock
+# before it writes to the log: a second writer of hospitals waits until the first has
+# committed, so the seqs of committed rows are visible in order and no gap closes later.
+# Only transactions writing hospitals wait for each other (they are rare and short); other
+# transactions, however long, don't hold the feed back.
+CHANGE_LOG_TABLE_NAME = "hospital_changes"
+CHANGE_LOG_PRUNED_TABLE_NAME = "hospital_changes_pruned"  # Newest cursor removed by prune()
+CHANGE_POLL_SECONDS = 1.0
+CHANGE_FETCH_LIMIT = 1000  # Rows per catch-up query
+CHANGE_RETENTION_DAYS = 7  # Older log rows are deleted; clients further behind get a "reset"
+HEARTBEAT_SECONDS = 15  # Comment line sent on idle streams so proxies keep them open
+SUBSCRIBER_QUEUE_SIZE = 1000  # A client this far behind is disconnected (and catches up on reconnect)
+
+SQL_CREATE_CHANGE_LOG = f"""
+    CREATE TABLE IF NOT EXISTS public."{CHANGE_LOG_TABLE_NAME}" (
+        seq bigserial PRIMARY KEY,
+        op text NOT NULL,
+        hospital_id bigint NOT NULL,
+        hospital jsonb,
+        txid bigint NOT NULL DEFAULT txid_current(),
+        changed_at timestamptz NOT NULL DEFAULT clock_timestamp()
+    );
+"""
+SQL_CREATE_CHANGE_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION public.log_hospital_change() RETURNS trigger AS $$
+    BEGIN
+        -- Held until commit, so the next writer takes its seqs after this one is visible
+        PERFORM pg_advisory_xact_lock(hashtext('{CHANGE_LOG_TABLE_NAME}_writer'));
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO public."{CHANGE_LOG_TABLE_NAME}" (op, hospital_id) VALUES ('delete', OLD.id);
+            RETURN OLD;
+        END IF;
+        INSERT INTO public."{CHANGE_LOG_TABLE_NAME}" (op, hospital_id, hospital)
+        VALUES (lower(TG_OP), NEW.id, jsonb_build_object(
+            'id', NEW.id,
+            'name', NEW.name,
+            'doctor_count', NEW.doctor_count,
+            'longitude', ST_X(NEW.geom),
+            'latitude', ST_Y(NEW.geom)
+        ));
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+SQL_CREATE_CHANGE_TRIGGER = """
+    CREATE TRIGGER hospitals_change_log
+    AFTER INSERT OR UPDATE OR DELETE ON public."hospitals"
+    FOR EACH ROW EXECUTE FUNCTION public.log_hospital_change();
+"""
+SQL_CREATE_PRUNED_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS public."{CHANGE_LOG_PRUNED_TABLE_NAME}" (
+        id int PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        txid bigint NOT NULL,
+        seq bigint NOT NULL
+    );
+"""
+SQL_FETCH_CHANGES = f"""
+    SELECT txid, seq, op, hospital_id, hospital, changed_at
+    FROM public."{CHANGE_LOG_TABLE_NAME}"
+    WHERE seq > :after_seq
+    ORDER BY seq
+    LIMIT :limit;
+"""
+# Newest change in the log, or the newest pruned one once prune() has emptied the log
+SQL_CURRENT_CURSOR = f"""
+    SELECT txid, seq FROM (
+        (SELECT txid, seq FROM public."{CHANGE_LOG_TABLE_NAME}" ORDER BY seq DESC LIMIT 1)
+        UNION ALL
+        SELECT txid, seq FROM public."{CHANGE_LOG_PRUNED_TABLE_NAME}"
+    ) newest
+    ORDER BY seq DESC
+    LIMIT 1;
+"""
+# Deletes old rows and remembers the newest deleted cursor, so clients behind it get a "reset"
+SQL_PRUNE_CHANGES = f"""
+    WITH deleted AS (
+        DELETE FROM public."{CHANGE_LOG_TABLE_NAME}"
+        WHERE changed_at < now() - make_interval(days => :days)
+        RETURNING txid, seq
+    )
+    INSERT INTO public."{CHANGE_LOG_PRUNED_TABLE_NAME}" AS pruned (id, txid, seq)
+    SELECT 1, txid, seq FROM deleted ORDER BY seq DESC LIMIT 1
+    ON CONFLICT (id) DO UPDATE SET txid = EXCLUDED.txid, seq = EXCLUDED.seq
+    WHERE pruned.seq < EXCLUDED.seq;
+"""
+START_CURSOR = (0, 0)  # Before every change
+
+
+def format_cursor(cursor):
+    """Cursor tuple (txid, seq) -> "<txid>:<seq>" (SSE event id, X-Hospital-Change-Seq header)."""
+    return f"{cursor[0]}:{cursor[1]}"
+
+
+def parse_cursor(value):
+    """ "<txid>:<seq>" -> cursor tuple. Raises ValueError for anything else."""
+    txid, separator, seq = value.partition(":")
+    if not separator:
+        raise ValueError(f"'{value}' is not a change cursor (<txid>:<seq>).")
+    return int(txid), int(seq)
+
+
+def cursor_seq(cursor):
+    """Position of a cursor in the feed: changes are ordered by seq alone."""
+    return cursor[1]
+
+
+def format_event(event, data, event_id=None):
+    """One Server-Sent Events message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class HospitalChangeFeed:
+    """
+    Polls the hospital change log and streams new changes to every connected client.
+    The database methods block and are run in worker threads; the rest runs on the event loop.
+    """
+
+    def __init__(self):
+        self.last_cursor = None  # Cursor of the newest change handed to the subscribers
+        self.subscribers = set()
+
+    # --- Database side ---
+    def ensure_change_log(self, engine):
+        """Create the change log table and the trigger feeding it, if missing."""
+        with engine.connect() as connection:
+            with connection.begin():
+                # Several workers start at once; only one of them runs the DDL at a time
+                connection.execute(
+                    text("SELECT pg_advisory_xact_lock(hashtext(:name));"),
+                    {"name": CHANGE_LOG_TABLE_NAME},
+                )
+                connection.execute(text(SQL_CREATE_CHANGE_LOG))
+                connection.execute(text(SQL_CREATE_PRUNED_TABLE))
+                connection.execute(text(SQL_CREATE_CHANGE_FUNCTION))
+                trigger_exists = connection.execute(
+                    text(
+                        "SELECT 1 FROM pg_trigger WHERE tgname = 'hospitals_change_log' "
+                        """AND tgrelid = 'public."hospitals"'::regclass;"""
+                    )
+                ).first()
+                if trigger_exists is None:
+                    connection.execute(text(SQL_CREATE_CHANGE_TRIGGER))
+                    print("Hospital change log trigger created.")
+
+    def current_cursor(self, engine):
+        """
+        Cursor of the newest change, including pruned ones (START_CURSOR if there never was one).
+        Never below pruned_cursor, so a client starting from it isn't sent a "reset".
+        """
+        with engine.connect() as connection:
+            row = connection.execute(text(SQL_CURRENT_CURSOR)).first()
+        return tuple(row) if row else START_CURSOR
+
+    def pruned_cursor(self, engine):
+        """Cursor of the newest change removed by prune() (None if nothing was pruned yet)."""
+        with engine.connect() as connection:
+            row = connection.execute(
+                text(f'SELECT txid, seq FROM public."{CHANGE_LOG_PRUNED_TABLE_NAME}";')
+            ).first()
+        return tuple(row) if row else None
+
+    def fetch_changes(self, engine, after_cursor):
+        """All changes after 'after_cursor', in cursor order, as JSON-ready dictionaries."""
+        changes = []
+        with engine.connect() as connection:
+            while True:
+                rows = connection.execute(
+                    text(SQL_FETCH_CHANGES),
+                    {"after_seq": cursor_seq(after_cursor), "limit": CHANGE_FETCH_LIMIT},
+                ).all()
+                changes += [
+                    {
+                        "cursor": format_cursor((txid, seq)),
+                        "seq": seq,
+                        "op": op,
+                        "hospital_id": hospital_id,
+                        "hospital": hospital,
+                        "changed_at": changed_at.isoformat(),
+                    }
+                    for txid, seq, op, hospital_id, hospital, changed_at in rows
+                ]
+                if len(rows) < CHANGE_FETCH_LIMIT:
+                    return changes
+                after_cursor = (rows[-1][0], rows[-1][1])
+
+    def poll(self, engine):
+        """Return the changes that became visible since the last poll."""
+        if self.last_cursor is None:
+            self.last_cursor = self.current_cursor(engine)
+            return []
+        changes = self.fetch_changes(engine, self.last_cursor)
+        if changes:
+            self.last_cursor = parse_cursor(changes[-1]["cursor"])
+        return changes
+
+    def prune(self, engine):
+        """Delete log rows older than CHANGE_RETENTION_DAYS."""
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(text(SQL_PRUNE_CHANGES), {"days": CHANGE_RETENTION_DAYS})
+
+    # --- Fan-out ---
+    def publish(self, changes):
+        """Hand new changes to every subscriber. Subscribers that fell too far behind are dropped."""
+        for queue in list(self.subscribers):
+            try:
+                for change in changes:
+                    queue.put_nowait(change)
+            except asyncio.QueueFull:
+                # Empty the queue and end the stream; the client reconnects with its
+                # Last-Event-ID and catches up from the log without a gap
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.subscribers.discard(queue)
+
+    async def stream(self, engine, after_cursor=None):
+        """
+        Async generator of SSE messages for one client: a "hello" with the current cursor
+        (or a "reset" if changes after 'after_cursor' were pruned), the missed changes
+        after 'after_cursor', then live changes and heartbeats.
+        """
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Subscribe before reading the backlog, so nothing falls between the two
+        self.subscribers.add(queue)
+        try:
+            if after_cursor is None:
+                after_cursor = await asyncio.to_thread(self.current_cursor, engine)
+                yield format_event("hello", {"cursor": format_cursor(after_cursor)})
+            else:
+                pruned_cursor = await asyncio.to_thread(self.pruned_cursor, engine)
+                if pruned_cursor is not None and cursor_seq(after_cursor) < cursor_seq(pruned_cursor):
+                    # Changes were pruned: the client must reload /get_hospitals
+                    after_cursor = await asyncio.to_thread(self.current_cursor, engine)
+                    yield format_event("reset", {"cursor": format_cursor(after_cursor)})
+                else:
+                    yield format_event("hello", {"cursor": format_cursor(after_cursor)})
+                    for change in await asyncio.to_thread(self.fetch_changes, engine, after_cursor):
+                        yield format_event("hospital", change, change["cursor"])
+                        after_cursor = parse_cursor(change["cursor"])
+
+            while True:
+                try:
+                    change = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if change is None:
+                    return
+                cursor = parse_cursor(change["cursor"])
+                if cursor_seq(cursor) <= cursor_seq(after_cursor):
+                    continue  # Already sent as part of the backlog
+                yield format_event("hospital", change, change["cursor"])
+                after_cursor = cursor
+        finally:
+            self.subscribers.discard(queue)
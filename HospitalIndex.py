@@ -0,0 +1,142 @@
+# Import necessary libraries
+import numpy as np  # For vectorized distance calculations
+import shapely  # For the STRtree spatial index and vectorized point creation
+
+# --- Nearest Hospital Index Configuration ---
+# "Which hospitals are closest to this point?" is asked on every map click, so the hospitals
+# are kept in memory in a shapely STRtree instead of asking the database each time.
+# The tree works in lon/lat degrees; true distances are great-circle (haversine) metres.
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_METERS * np.pi / 180  # One degree of latitude on that sphere
+COVERAGE_SAFETY_FACTOR = 0.99  # Keeps the "certainly inside the search radius" bound on the safe side
+INITIAL_SEARCH_RADIUS_DEGREES = 0.05  # About 5 km; doubled until k hospitals are certainly found
+SQL_QUERY_HOSPITAL_POINTS = """
+    SELECT id, name, doctor_count, ST_X(geom) AS longitude, ST_Y(geom) AS latitude
+    FROM public."hospitals"
+    WHERE geom IS NOT NULL
+    ORDER BY id;
+"""
+
+
+def haversine_meters(lon1, lat1, lon2, lat2):
+    """Great-circle distance in metres between arrays of lon/lat points."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class HospitalIndex:
+    """Immutable STRtree of hospital points answering k-nearest queries (single or batch)."""
+
+    def __init__(self, ids, names, doctor_counts, longitudes, latitudes):
+        self.ids = np.asarray(ids, dtype="int64")
+        self.names = list(names)
+        self.doctor_counts = np.asarray(doctor_counts, dtype="float64")  # NaN = unknown
+        self.longitudes = np.asarray(longitudes, dtype="float64")
+        self.latitudes = np.asarray(latitudes, dtype="float64")
+        self.tree = shapely.STRtree(shapely.points(self.longitudes, self.latitudes))
+
+    @classmethod
+    def from_database(cls, engine):
+        """Build the index from public.hospitals."""
+        from sqlalchemy import text  # Only needed when reading from the database
+
+        with engine.connect() as connection:
+            rows = connection.execute(text(SQL_QUERY_HOSPITAL_POINTS)).all()
+        if not rows:
+            return cls([], [], [], [], [])
+        ids, names, doctor_counts, longitudes, latitudes = zip(*rows)
+        doctor_counts = [np.nan if count is None else count for count in doctor_counts]
+        return cls(ids, names, doctor_counts, longitudes, latitudes)
+
+    @classmethod
+    def from_arrays(cls, arrays, names):
+        """Build the index from arrays() output (memory-mapped arrays are used without copying)."""
+        return cls(
+            arrays["hospital_ids"],
+            names,
+            arrays["hospital_doctor_counts"],
+            arrays["hospital_longitudes"],
+            arrays["hospital_latitudes"],
+        )
+
+    def arrays(self):
+        """The numeric columns of the index, by name (the names list is kept separately)."""
+        return {
+            "hospital_ids": self.ids,
+            "hospital_doctor_counts": self.doctor_counts,
+            "hospital_longitudes": self.longitudes,
+            "hospital_latitudes": self.latitudes,
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, longitudes, latitudes, k=5):
+        """
+        Return, for every query point, the indices and distances (metres) of its k nearest hospitals.
+        All query points are answered with vectorized STRtree queries: a dwithin search with a
+        growing radius, until the radius is certainly big enough to hold the k true nearest.
+        """
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype="float64"))
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype="float64"))
+        results = [(np.array([], dtype="int64"), np.array([]))] * len(longitudes)
+        k = min(k, len(self))
+        if k <= 0:
+            return results
+
+        pending = np.arange(len(longitudes))
+        radius = INITIAL_SEARCH_RADIUS_DEGREES
+        while pending.size:
+            points = shapely.points(longitudes[pending], latitudes[pending])
+            query_index, hospital_index = self.tree.query(
+                points, predicate="dwithin", distance=radius
+            )
+            distances = haversine_meters(
+                longitudes[pending][query_index],
+                latitudes[pending][query_index],
+                self.longitudes[hospital_index],
+                self.latitudes[hospital_index],
+            )
+            # Everything within this many metres is guaranteed to be inside the degree radius
+            # (a degree of longitude shrinks towards the poles, so use the worst latitude)
+            worst_latitude = np.minimum(np.abs(latitudes[pending]) + radius, 89.9)
+            covered_meters = (
+                radius * METERS_PER_DEGREE * np.cos(np.radians(worst_latitude)) * COVERAGE_SAFETY_FACTOR
+            )
+            searched_everything = radius >= 360
+
+            still_pending = []
+            order = np.argsort(query_index, kind="stable")
+            splits = np.searchsorted(query_index[order], np.arange(1, len(pending)))
+            for position, candidate_order in enumerate(np.split(order, splits)):
+                candidate_distances = distances[candidate_order]
+                if len(candidate_distances) >= k:
+                    best = np.argsort(candidate_distances)[:k]
+                    if searched_everything or candidate_distances[best[-1]] <= covered_meters[position]:
+                        results[pending[position]] = (
+                            hospital_index[candidate_order][best],
+                            candidate_distances[best],
+                        )
+                        continue
+                still_pending.append(pending[position])
+            pending = np.array(still_pending, dtype="int64")
+            radius *= 2
+        return results
+
+    def describe(self, indices, distances):
+        """Turn nearest() output for one point into JSON-ready hospital records."""
+        return [
+            {
+                "id": int(self.ids[i]),
+                "name": self.names[i],
+                "doctor_count": None if np.isnan(self.doctor_counts[i]) else int(self.doctor_counts[i]),
+                "latitude": float(self.latitudes[i]),
+                "longitude": float(self.longitudes[i]),
+                "distance_meters": round(float(distance), 1),
+            }
+            for i, distance in zip(indices, distances)
+        ]
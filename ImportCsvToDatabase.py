@@ -3,7 +3,9 @@ import pandas as pd
 import geopandas  # Used for handling geospatial data (GeoDataFrames) and interacting with PostGIS
 from sqlalchemy import create_engine  # Used to create a database connection engine
 from sqlalchemy import text  # Used to execute plain SQL queries securely via SQLAlchemy
-import time  # Optional, for timing operations (though not used extensively in this version)
+from sqlalchemy import bindparam  # Used to pass lists to IN (...) conditions
+from QueryCache import install_version_triggers  # Version markers for cached reads
+import time  # Used for timing the slower import steps
 import tkinter as tk  # Tkinter for basic GUI functionality
 from tkinter import ttk  # Themed widgets for a more modern look
 from tkinter import filedialog  # Standard dialogs for opening/saving files
@@ -11,6 +13,539 @@ from tkinter import (
     messagebox,
 )  # Standard dialogs for displaying messages (info, warning, error)
 import os  # Used for basic operating system interactions (like getting basename of a file path)
+import re  # Used to turn partition values into safe table-name suffixes
+import io  # Used to parse raw CSV chunks from memory
+import csv  # Used to write rejected rows to the reject file
+import numpy as np  # Used for the vectorized space-filling-curve sort keys
+from ImportVectorToDatabase import (
+    VECTOR_FILE_EXTENSIONS,
+    import_vector_file,
+    is_vector_file,
+)  # Vector mode: shapefiles and other vector formats
+
+# --- Physical Layout Options ---
+# Rows are written to PostGIS in the order they are stored in the DataFrame. By default that
+# is CSV order, so neighbouring points end up on far-apart pages and a bbox/buffer query
+# touches pages scattered over the whole table even when the GIST index is used.
+# Sorting by a space-filling curve (or CLUSTER-ing afterwards) keeps nearby points on
+# nearby pages, so viewport and buffer queries read contiguous pages.
+LAYOUT_CSV_ORDER = "CSV order"
+LAYOUT_HILBERT = "Hilbert curve sort"
+LAYOUT_GEOHASH = "Geohash sort"
+LAYOUT_CLUSTER = "CLUSTER after load"
+LAYOUT_OPTIONS = [LAYOUT_CSV_ORDER, LAYOUT_HILBERT, LAYOUT_GEOHASH, LAYOUT_CLUSTER]
+# A file read at once is sorted in memory. A chunked import can't do that, so it stores the curve
+# key of every row in a load table and the database copies the rows over in key order
+# (see copy_in_key_order).
+CURVE_SORT_LAYOUTS = (LAYOUT_HILBERT, LAYOUT_GEOHASH)
+
+# Spatial index options. BRIN indexes are tiny and cheap to build, and they work well for
+# huge append-only grids as long as the rows are physically sorted (see above).
+INDEX_GIST = "GIST"
+INDEX_BRIN = "BRIN"
+INDEX_GIST_AND_BRIN = "GIST + BRIN"
+INDEX_OPTIONS = [INDEX_GIST, INDEX_BRIN, INDEX_GIST_AND_BRIN]
+BRIN_PAGES_PER_RANGE = 32  # Smaller ranges = more precise BRIN summaries, slightly bigger index
+
+# Partitioning options (LIST partitions on the WorldPop 'Country' / 'Year' columns)
+PARTITION_NONE = "None"
+PARTITION_COUNTRY = "Country"
+PARTITION_YEAR = "Year"
+PARTITION_COUNTRY_YEAR = "Country + Year"
+PARTITION_OPTIONS = [
+    PARTITION_NONE,
+    PARTITION_COUNTRY,
+    PARTITION_YEAR,
+    PARTITION_COUNTRY_YEAR,
+]
+
+HILBERT_ORDER = 16  # Grid of 2^16 x 2^16 cells over the data extent
+# Keys of a chunked import must compare across chunks, so they use the whole lon/lat range
+# instead of each chunk's extent, on a finer grid (~2 m cells, still fits in int64)
+WORLD_BOUNDS = (-180.0, -90.0, 180.0, 90.0)
+WORLD_HILBERT_ORDER = 24
+SORT_KEY_COLUMN = "_sort_key"
+LOAD_TABLE_SUFFIX = "__unsorted"
+
+# --- Chunked / Resumable Import ---
+# Large CSVs are loaded in chunks. Every chunk is written in the same transaction that
+# advances its checkpoint (byte offset + row counts) in this table, so after a dropped
+# connection the import can resume from the last committed chunk instead of from zero.
+# Note: chunks are cut at line breaks, so quoted fields must not contain newlines
+# (true for WorldPop CSVs).
+DEFAULT_CHUNK_SIZE = 200000  # Rows per chunk (0 = read the whole file at once)
+CHECKPOINT_TABLE_NAME = "import_checkpoints"
+REJECT_FILE_SUFFIX = ".rejected.csv"  # Bad rows are written next to the CSV
+# Which columns are numeric is fixed once per import: from the existing table when appending
+# to it, otherwise from the first chunk (a column counts as numeric when at least this share of
+# its non-empty values are numbers). A value that isn't a number in a numeric column rejects
+# its row, instead of failing the insert of the whole chunk.
+NUMERIC_COLUMN_SHARE = 0.5
+NUMERIC_DATA_TYPES = ("double precision", "real", "numeric", "integer", "bigint", "smallint")
+
+
+def hilbert_index(x, y, order=HILBERT_ORDER, bounds=None):
+    """
+    Compute the Hilbert curve index of every (x, y) point, vectorized with NumPy.
+    The points are scaled onto a 2^order x 2^order grid covering 'bounds'
+    (min_x, min_y, max_x, max_y), by default their own bounding box.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = 1 << order
+    if bounds is None:
+        bounds = (np.nanmin(x), np.nanmin(y), np.nanmax(x), np.nanmax(y))
+    min_x, min_y, max_x, max_y = (float(value) for value in bounds)
+    # Scale coordinates to integer grid cells (guard against a zero-width extent)
+    x_span = max(max_x - min_x, 1e-12)
+    y_span = max(max_y - min_y, 1e-12)
+    xi = ((np.clip(x, min_x, max_x) - min_x) / x_span * (n - 1)).astype("int64")
+    yi = ((np.clip(y, min_y, max_y) - min_y) / y_span * (n - 1)).astype("int64")
+
+    d = np.zeros(len(xi), dtype="int64")
+    s = n >> 1
+    while s > 0:
+        rx = ((xi & s) > 0).astype("int64")
+        ry = ((yi & s) > 0).astype("int64")
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        flip = (ry == 0) & (rx == 1)
+        xi = np.where(flip, n - 1 - xi, xi)
+        yi = np.where(flip, n - 1 - yi, yi)
+        swap = ry == 0
+        xi, yi = np.where(swap, yi, xi), np.where(swap, xi, yi)
+        s >>= 1
+    return d
+
+
+def geohash_index(x, y, bits_per_axis=HILBERT_ORDER):
+    """
+    Compute a geohash-ordered key for every (lon, lat) point, vectorized with NumPy.
+    A geohash is the interleaving of longitude and latitude bits (longitude first),
+    so sorting by this integer gives exactly the same order as sorting by geohash strings.
+    """
+    n = 1 << bits_per_axis
+    lon = np.clip(np.asarray(x, dtype="float64"), -180.0, 180.0)
+    lat = np.clip(np.asarray(y, dtype="float64"), -90.0, 90.0)
+    lon_i = ((lon + 180.0) / 360.0 * (n - 1)).astype("int64")
+    lat_i = ((lat + 90.0) / 180.0 * (n - 1)).astype("int64")
+
+    key = np.zeros(len(lon_i), dtype="int64")
+    for bit in range(bits_per_axis - 1, -1, -1):
+        key = (key << 1) | ((lon_i >> bit) & 1)
+        key = (key << 1) | ((lat_i >> bit) & 1)
+    return key
+
+
+def spatially_sort(df, layout):
+    """
+    Return the DataFrame re-ordered by the chosen space-filling curve.
+    Any other layout option leaves the rows in CSV order.
+    """
+    if layout == LAYOUT_HILBERT:
+        sort_key = hilbert_index(df["x"].to_numpy(), df["y"].to_numpy())
+    elif layout == LAYOUT_GEOHASH:
+        sort_key = geohash_index(df["x"].to_numpy(), df["y"].to_numpy())
+    else:
+        return df
+    # Stable sort so rows in the same grid cell keep their CSV order
+    order = np.argsort(sort_key, kind="stable")
+    return df.iloc[order].reset_index(drop=True)
+
+
+def curve_sort_key(df, layout):
+    """
+    Curve key of every row for a chunked import: unlike spatially_sort, keys of different
+    chunks compare, because the grid covers the whole world.
+    """
+    if layout == LAYOUT_HILBERT:
+        return hilbert_index(
+            df["x"].to_numpy(), df["y"].to_numpy(), WORLD_HILBERT_ORDER, WORLD_BOUNDS
+        )
+    return geohash_index(df["x"].to_numpy(), df["y"].to_numpy())
+
+
+def copy_in_key_order(connection, load_table, write_table):
+    """
+    Replace public.<write_table> by the rows of public.<load_table> in SORT_KEY_COLUMN order
+    (without that column) and drop the load table. The database sorts on disk if needed,
+    so the whole table ends up in curve order without holding it in memory.
+    """
+    columns = (
+        connection.execute(
+            text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = :table AND column_name <> :key "
+                "ORDER BY ordinal_position;"
+            ),
+            {"table": load_table, "key": SORT_KEY_COLUMN},
+        )
+        .scalars()
+        .all()
+    )
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    connection.execute(text(f'DROP TABLE IF EXISTS public."{write_table}";'))
+    connection.execute(
+        text(f'CREATE TABLE public."{write_table}" (LIKE public."{load_table}");')
+    )
+    connection.execute(
+        text(f'ALTER TABLE public."{write_table}" DROP COLUMN "{SORT_KEY_COLUMN}";')
+    )
+    connection.execute(
+        text(
+            f'INSERT INTO public."{write_table}" ({column_list}) '
+            f'SELECT {column_list} FROM public."{load_table}" ORDER BY "{SORT_KEY_COLUMN}";'
+        )
+    )
+    connection.execute(text(f'DROP TABLE public."{load_table}";'))
+
+
+def partition_columns_for(partition_option):
+    """Return the list of columns used for partitioning, outermost level first."""
+    return {
+        PARTITION_NONE: [],
+        PARTITION_COUNTRY: ["Country"],
+        PARTITION_YEAR: ["Year"],
+        PARTITION_COUNTRY_YEAR: ["Country", "Year"],
+    }[partition_option]
+
+
+def sql_literal(value):
+    """Render a partition bound value as a SQL literal (strings quoted, numbers as-is)."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def partition_suffix(value):
+    """Turn a partition value into a safe table-name suffix, e.g. 'EGY' -> 'egy'."""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return re.sub(r"[^0-9a-zA-Z]+", "_", str(value)).strip("_").lower() or "empty"
+
+
+def table_exists(connection, table_name):
+    """Return True if public.<table_name> exists."""
+    return (
+        connection.execute(
+            text("SELECT to_regclass(:name);"), {"name": f'public."{table_name}"'}
+        ).scalar()
+        is not None
+    )
+
+
+def create_partitioned_table(
+    connection, output_table, staging_table, columns, keep_existing=False
+):
+    """
+    Create 'output_table' as a LIST-partitioned copy of 'staging_table' and move the rows over.
+    One partition is created per distinct value of columns[0]; when a second column is given,
+    every partition is itself LIST-partitioned on it (e.g. Country -> Year).
+    The rows are copied in the (already spatially sorted) order of the staging table.
+    With keep_existing, an existing table partitioned the same way is kept: missing partitions
+    are created, and existing leaf partitions lose only the rows being re-imported, so yearly
+    files can be added one at a time. A leaf whose rows carry a "Country" that isn't a
+    partition column (e.g. partitioned by Year only) keeps the other countries' rows; without
+    such a column the leaf's rows are all replaced.
+    """
+    # Columns are named, so an existing table with another column order still lines up
+    staging_columns = connection.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = :table ORDER BY ordinal_position;"
+        ),
+        {"table": staging_table},
+    ).scalars().all()
+    # Columns identifying whose rows a leaf partition holds, beyond the partition columns
+    replace_columns = [
+        column for column in ["Country"] if column in staging_columns and column not in columns
+    ]
+
+    if keep_existing and table_exists(connection, output_table):
+        partition_key = connection.execute(
+            text("SELECT pg_get_partkeydef(to_regclass(:name));"),
+            {"name": f'public."{output_table}"'},
+        ).scalar()
+        if partition_key != f'LIST ("{columns[0]}")':
+            raise ValueError(
+                f"Table '{output_table}' exists but is partitioned by {partition_key or 'nothing'}, "
+                f'not LIST ("{columns[0]}").'
+            )
+        print(f"Adding partitions to existing table '{output_table}'.")
+    else:
+        keep_existing = False
+        connection.execute(text(f'DROP TABLE IF EXISTS public."{output_table}" CASCADE;'))
+        connection.execute(
+            text(
+                f'CREATE TABLE public."{output_table}" '
+                f'(LIKE public."{staging_table}" INCLUDING DEFAULTS) '
+                f'PARTITION BY LIST ("{columns[0]}");'
+            )
+        )
+
+    def create_partitions(parent_table, parent_filter, level):
+        column = columns[level]
+        # Distinct values are read from the staging table, so this also works for chunked imports
+        values = connection.execute(
+            text(
+                f'SELECT DISTINCT "{column}" FROM public."{staging_table}" '
+                f'WHERE "{column}" IS NOT NULL{parent_filter};'
+            )
+        ).scalars()
+        for value in list(values):
+            child_table = f"{parent_table}_{partition_suffix(value)}"
+            is_leaf = level + 1 == len(columns)
+            child_exists = keep_existing and table_exists(connection, child_table)
+            if child_exists and is_leaf:
+                # Re-importing e.g. a year replaces that year's rows of the imported countries only
+                child_filter = f'"{column}" = {sql_literal(value)}{parent_filter}'
+                if replace_columns:
+                    key_list = ", ".join(f'"{key}"' for key in replace_columns)
+                    deleted = connection.execute(
+                        text(
+                            f'DELETE FROM public."{child_table}" WHERE ({key_list}) IN '
+                            f'(SELECT DISTINCT {key_list} FROM public."{staging_table}" WHERE {child_filter});'
+                        )
+                    ).rowcount
+                else:
+                    deleted = connection.execute(
+                        text(f'DELETE FROM public."{child_table}";')
+                    ).rowcount
+                print(
+                    f"Replacing {deleted} rows of partition '{child_table}' for {column} = {value}"
+                )
+            if not child_exists:
+                sub_partition = ""
+                if not is_leaf:
+                    sub_partition = f' PARTITION BY LIST ("{columns[level + 1]}")'
+                connection.execute(
+                    text(
+                        f'CREATE TABLE public."{child_table}" PARTITION OF public."{parent_table}" '
+                        f"FOR VALUES IN ({sql_literal(value)}){sub_partition};"
+                    )
+                )
+                print(f"Created partition '{child_table}' for {column} = {value}")
+            if not is_leaf:
+                create_partitions(
+                    child_table,
+                    f'{parent_filter} AND "{column}" = {sql_literal(value)}',
+                    level + 1,
+                )
+
+    create_partitions(output_table, "", 0)
+
+    column_list = ", ".join(f'"{column}"' for column in staging_columns)
+    connection.execute(
+        text(
+            f'INSERT INTO public."{output_table}" ({column_list}) '
+            f'SELECT {column_list} FROM public."{staging_table}";'
+        )
+    )
+    connection.execute(text(f'DROP TABLE public."{staging_table}";'))
+
+
+def create_spatial_indexes(connection, output_table, index_option):
+    """
+    Create the requested spatial index(es) on the 'geometry' column.
+    Returns the name of the GIST index (needed for CLUSTER), or None if no GIST index was made.
+    """
+    gist_index_name = None
+    if index_option in (INDEX_GIST, INDEX_GIST_AND_BRIN):
+        gist_index_name = f"{output_table}_geom_idx"
+        # IF NOT EXISTS prevents error if index already exists
+        connection.execute(
+            text(
+                f"""
+                CREATE INDEX IF NOT EXISTS "{gist_index_name}"
+                ON public."{output_table}" -- Assuming default 'public' schema
+                USING GIST (geometry);
+                """
+            )
+        )
+        print(f"GIST index '{gist_index_name}' created.")
+    if index_option in (INDEX_BRIN, INDEX_GIST_AND_BRIN):
+        brin_index_name = f"{output_table}_geom_brin_idx"
+        connection.execute(
+            text(
+                f"""
+                CREATE INDEX IF NOT EXISTS "{brin_index_name}"
+                ON public."{output_table}"
+                USING BRIN (geometry) WITH (pages_per_range = {BRIN_PAGES_PER_RANGE});
+                """
+            )
+        )
+        print(f"BRIN index '{brin_index_name}' created.")
+    return gist_index_name
+
+
+def cluster_table(engine, output_table, gist_index_name):
+    """
+    CLUSTER a table on its GIST index. A partitioned table can't be clustered as a whole
+    (PostgreSQL 14 and older refuse it, 15+ only outside a transaction block), so every leaf
+    partition is clustered on its own copy of the index, each in its own transaction.
+    Returns the number of tables clustered.
+    """
+    with engine.connect() as connection:
+        leaves = connection.execute(
+            text(
+                "SELECT i.indrelid::regclass::text, t.relid::regclass::text "
+                "FROM pg_partition_tree(CAST(:index AS regclass)) t "
+                "JOIN pg_index i ON i.indexrelid = t.relid "
+                "WHERE t.isleaf;"
+            ),
+            {"index": f'public."{gist_index_name}"'},
+        ).all()
+    for leaf_table, leaf_index in leaves:
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(text(f"CLUSTER {leaf_table} USING {leaf_index};"))
+        print(f"Clustered {leaf_table} on {leaf_index}.")
+    return len(leaves)
+
+
+def ensure_checkpoint_table(connection):
+    """Create the checkpoint table if it doesn't exist yet."""
+    connection.execute(
+        text(
+            f"""
+            CREATE TABLE IF NOT EXISTS public."{CHECKPOINT_TABLE_NAME}" (
+                table_name TEXT PRIMARY KEY,
+                csv_path TEXT NOT NULL,
+                csv_size BIGINT NOT NULL,
+                byte_offset BIGINT NOT NULL,
+                rows_committed BIGINT NOT NULL,
+                rows_rejected BIGINT NOT NULL,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+    )
+
+
+def load_checkpoint(connection, table_name):
+    """Return the checkpoint row (as a dict) for 'table_name', or None."""
+    row = connection.execute(
+        text(
+            f'SELECT * FROM public."{CHECKPOINT_TABLE_NAME}" WHERE table_name = :table_name;'
+        ),
+        {"table_name": table_name},
+    ).mappings().one_or_none()
+    return dict(row) if row else None
+
+
+def save_checkpoint(connection, checkpoint):
+    """Insert or update the checkpoint row (call inside the chunk's transaction)."""
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO public."{CHECKPOINT_TABLE_NAME}"
+                (table_name, csv_path, csv_size, byte_offset, rows_committed, rows_rejected, updated_at)
+            VALUES
+                (:table_name, :csv_path, :csv_size, :byte_offset, :rows_committed, :rows_rejected, CURRENT_TIMESTAMP)
+            ON CONFLICT (table_name) DO UPDATE SET
+                csv_path = EXCLUDED.csv_path,
+                csv_size = EXCLUDED.csv_size,
+                byte_offset = EXCLUDED.byte_offset,
+                rows_committed = EXCLUDED.rows_committed,
+                rows_rejected = EXCLUDED.rows_rejected,
+                updated_at = CURRENT_TIMESTAMP;
+            """
+        ),
+        checkpoint,
+    )
+
+
+def delete_checkpoint(connection, table_name):
+    connection.execute(
+        text(
+            f'DELETE FROM public."{CHECKPOINT_TABLE_NAME}" WHERE table_name = :table_name;'
+        ),
+        {"table_name": table_name},
+    )
+
+
+def read_csv_chunks(csv_path, chunk_size, start_offset=None):
+    """
+    Read the CSV in chunks of 'chunk_size' lines, starting at byte 'start_offset'
+    (None = just after the header).
+    Yields (chunk DataFrame, byte offset after the chunk, list of unparseable lines).
+    """
+    with open(csv_path, "rb") as csv_file:
+        header = csv_file.readline()
+        if start_offset is not None:
+            csv_file.seek(start_offset)
+        while True:
+            lines = []
+            for _ in range(chunk_size):
+                line = csv_file.readline()
+                if not line:
+                    break
+                if line.strip():
+                    lines.append(line)
+            if not lines:
+                return
+            end_offset = csv_file.tell()
+            raw_chunk = header + b"".join(lines)
+
+            bad_lines = []
+            try:
+                # Fast C parser first; most chunks have no structural problems
+                chunk = pd.read_csv(io.BytesIO(raw_chunk))
+            except pd.errors.ParserError:
+                # Slower python parser that hands broken lines to a callback instead of failing
+                chunk = pd.read_csv(
+                    io.BytesIO(raw_chunk),
+                    engine="python",
+                    on_bad_lines=lambda fields: bad_lines.append(fields),
+                )
+            yield chunk, end_offset, bad_lines
+
+
+def infer_numeric_columns(chunk):
+    """Columns of a CSV chunk holding numbers (x and y always do), in CSV order."""
+    numeric_columns = []
+    for column in chunk.columns:
+        values = chunk[column].dropna()
+        parsed = pd.to_numeric(values, errors="coerce").notna()
+        if column in ("x", "y") or (len(values) and parsed.mean() >= NUMERIC_COLUMN_SHARE):
+            numeric_columns.append(column)
+    return numeric_columns
+
+
+def table_numeric_columns(connection, table_name):
+    """Columns of public.<table_name> with a numeric data type."""
+    return (
+        connection.execute(
+            text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = :table AND data_type IN :types;"
+            ).bindparams(bindparam("types", expanding=True)),
+            {"table": table_name, "types": list(NUMERIC_DATA_TYPES)},
+        )
+        .scalars()
+        .all()
+    )
+
+
+def split_valid_rows(chunk, numeric_columns):
+    """
+    Split a chunk into valid rows and rows to reject: rows without usable x/y, or with a value
+    that isn't a number in one of 'numeric_columns' (empty values are fine).
+    Numeric columns are made float64 so every chunk produces the same table column types.
+    """
+    numeric_columns = [column for column in numeric_columns if column in chunk.columns]
+    # Coerced copies decide validity; rejected rows keep their original text so they can be fixed
+    coerced = chunk[numeric_columns].apply(pd.to_numeric, errors="coerce")
+    invalid_mask = (
+        (coerced.isna() & chunk[numeric_columns].notna()).any(axis=1)
+        | coerced["x"].isna()
+        | coerced["y"].isna()
+    )
+    valid = chunk[~invalid_mask].copy()
+    valid[numeric_columns] = coerced[~invalid_mask].astype("float64")
+    return valid, chunk[invalid_mask]
 
 
 # Define the main application window class, inheriting from tk.Tk
@@ -38,7 +573,7 @@ class RootWindow(tk.Tk):
 
         # --- CSV File Selection Section ---
         # Label and Button for choosing CSV file
-        input_csv_label = ttk.Label(main_frame, text="Select CSV File:")
+        input_csv_label = ttk.Label(main_frame, text="Select CSV / Vector File:")
         input_csv_label.grid(
             row=0, column=0, padx=5, pady=5, sticky="w"
         )  # Anchor to the west
@@ -115,9 +650,60 @@ class RootWindow(tk.Tk):
         )  # Expand east/west
         # Default value for table name is set AFTER file selection in select_input_csv
 
+        # --- Physical Layout / Index / Partition Options ---
+        # Physical row order written to the table
+        layout_label = ttk.Label(main_frame, text="Physical Layout:")
+        layout_label.grid(row=7, column=0, padx=5, pady=5, sticky="w")
+        self.layout_combobox = ttk.Combobox(
+            main_frame, values=LAYOUT_OPTIONS, state="readonly"
+        )
+        self.layout_combobox.set(LAYOUT_HILBERT)
+        self.layout_combobox.grid(row=7, column=1, padx=5, pady=5, sticky="ew")
+
+        # Spatial index type
+        index_label = ttk.Label(main_frame, text="Spatial Index:")
+        index_label.grid(row=8, column=0, padx=5, pady=5, sticky="w")
+        self.index_combobox = ttk.Combobox(
+            main_frame, values=INDEX_OPTIONS, state="readonly"
+        )
+        self.index_combobox.set(INDEX_GIST)
+        self.index_combobox.grid(row=8, column=1, padx=5, pady=5, sticky="ew")
+
+        # Partitioning
+        partition_label = ttk.Label(main_frame, text="Partition By:")
+        partition_label.grid(row=9, column=0, padx=5, pady=5, sticky="w")
+        self.partition_combobox = ttk.Combobox(
+            main_frame, values=PARTITION_OPTIONS, state="readonly"
+        )
+        self.partition_combobox.set(PARTITION_NONE)
+        self.partition_combobox.grid(row=9, column=1, padx=5, pady=5, sticky="ew")
+        # Add the file's years/countries to an existing partitioned table instead of replacing it
+        self.keep_partitions_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            main_frame,
+            text="Add to existing table",
+            variable=self.keep_partitions_var,
+        ).grid(row=9, column=2, padx=5, pady=5, sticky="w")
+
+        # --- Chunked / Resumable Import Options ---
+        # Chunk size (rows per committed chunk, 0 = load the whole file at once)
+        chunk_size_label = ttk.Label(main_frame, text="Chunk Size (rows, 0 = off):")
+        chunk_size_label.grid(row=10, column=0, padx=5, pady=5, sticky="w")
+        self.chunk_size_entry = ttk.Entry(main_frame)
+        self.chunk_size_entry.grid(row=10, column=1, padx=5, pady=5, sticky="ew")
+        self.chunk_size_entry.insert(0, str(DEFAULT_CHUNK_SIZE))
+
+        # Resume from the last committed chunk of a previous (failed) import
+        self.resume_import_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            main_frame,
+            text="Resume previous import from last checkpoint",
+            variable=self.resume_import_var,
+        ).grid(row=11, column=1, padx=5, pady=5, sticky="w")
+
         # --- Import Button ---
         ttk.Button(main_frame, text="Start Import", command=self.start_import).grid(
-            row=7,
+            row=12,
             column=0,
             columnspan=3,
             padx=5,
@@ -129,7 +715,7 @@ class RootWindow(tk.Tk):
         # Label to display the current status of the import process
         self.status_label = ttk.Label(main_frame, text="Status: Waiting for input...")
         self.status_label.grid(
-            row=8, column=0, columnspan=3, padx=5, pady=5, sticky="ew"
+            row=13, column=0, columnspan=3, padx=5, pady=5, sticky="ew"
         )  # Span across 3 columns and expand
 
         # Arrange the main frame to fill the window
@@ -141,7 +727,14 @@ class RootWindow(tk.Tk):
         csv_file_path = filedialog.askopenfilename(
             title="Select CSV file to upload",
             # Updated filetypes to a list of tuples as required
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            filetypes=[
+                ("CSV files", "*.csv"),
+                (
+                    "Vector files",
+                    " ".join(f"*{extension}" for extension in VECTOR_FILE_EXTENSIONS),
+                ),
+                ("All files", "*.*"),
+            ],
             parent=self,  # Set the parent window for the dialog
         )
 
@@ -162,6 +755,132 @@ class RootWindow(tk.Tk):
             # Optionally clear the output table name entry if file is unselected
             # self.output_table_entry.delete(0, tk.END)
 
+    # Method to load the CSV chunk by chunk, committing a checkpoint with every chunk
+    def import_csv_in_chunks(
+        self, engine, csv_path, write_table, layout, chunk_size, resume_import
+    ):
+        csv_size = os.path.getsize(csv_path)
+        reject_path = csv_path + REJECT_FILE_SUFFIX
+        # Curve sorts load the rows with their key into a load table and sort them at the end
+        sort_in_database = layout in CURVE_SORT_LAYOUTS
+        load_table = write_table + LOAD_TABLE_SUFFIX if sort_in_database else write_table
+        start_offset = None
+        rows_committed = 0
+        rows_rejected = 0
+
+        with engine.connect() as connection:
+            with connection.begin():
+                ensure_checkpoint_table(connection)
+                checkpoint = load_checkpoint(connection, write_table)
+
+        if resume_import and checkpoint:
+            # Only resume if the checkpoint belongs to this very file
+            if (
+                os.path.basename(checkpoint["csv_path"]) != os.path.basename(csv_path)
+                or checkpoint["csv_size"] != csv_size
+            ):
+                raise ValueError(
+                    f"The checkpoint for '{write_table}' belongs to '{checkpoint['csv_path']}' "
+                    f"({checkpoint['csv_size']} bytes), not to this file. Start a fresh import instead."
+                )
+            start_offset = checkpoint["byte_offset"]
+            rows_committed = checkpoint["rows_committed"]
+            rows_rejected = checkpoint["rows_rejected"]
+            print(
+                f"Resuming '{write_table}' at byte {start_offset} ({rows_committed} rows already committed)."
+            )
+        elif resume_import:
+            print(f"No checkpoint found for '{write_table}', starting from the beginning.")
+            resume_import = False
+
+        # A fresh import starts a new reject file; a resumed import keeps appending to it
+        if not resume_import or not os.path.exists(reject_path):
+            with open(csv_path, "r", newline="") as csv_file, open(
+                reject_path, "w", newline=""
+            ) as reject_file:
+                reject_file.write(csv_file.readline())
+
+        first_chunk = not resume_import
+        numeric_columns = None
+        if resume_import:
+            # Rows are appended to the table the first chunks created, so its column types apply
+            with engine.connect() as connection:
+                numeric_columns = table_numeric_columns(connection, load_table) or None
+        for chunk, end_offset, bad_lines in read_csv_chunks(
+            csv_path, chunk_size, start_offset
+        ):
+            chunk_start = time.perf_counter()
+            if numeric_columns is None:
+                numeric_columns = infer_numeric_columns(chunk)
+                print(f"Numeric columns: {numeric_columns}")
+            valid_rows, invalid_rows = split_valid_rows(chunk, numeric_columns)
+
+            # Bad rows go to the reject file instead of aborting the whole load
+            if bad_lines or not invalid_rows.empty:
+                with open(reject_path, "a", newline="") as reject_file:
+                    csv.writer(reject_file).writerows(bad_lines)
+                    invalid_rows.to_csv(reject_file, header=False, index=False)
+
+            if sort_in_database:
+                valid_rows[SORT_KEY_COLUMN] = curve_sort_key(valid_rows, layout)
+            geo_chunk = geopandas.GeoDataFrame(
+                valid_rows,
+                geometry=geopandas.points_from_xy(valid_rows.x, valid_rows.y),
+                crs="EPSG:4326",
+            )
+
+            # Chunk rows and checkpoint are committed together (or not at all)
+            with engine.connect() as connection:
+                with connection.begin():
+                    geo_chunk.to_postgis(
+                        name=load_table,
+                        con=connection,
+                        if_exists="replace" if first_chunk else "append",
+                        index=False,
+                    )
+                    rows_committed += len(geo_chunk)
+                    rows_rejected += len(bad_lines) + len(invalid_rows)
+                    save_checkpoint(
+                        connection,
+                        {
+                            "table_name": write_table,
+                            "csv_path": csv_path,
+                            "csv_size": csv_size,
+                            "byte_offset": end_offset,
+                            "rows_committed": rows_committed,
+                            "rows_rejected": rows_rejected,
+                        },
+                    )
+            first_chunk = False
+
+            progress = end_offset / csv_size * 100 if csv_size else 100
+            print(
+                f"Chunk committed in {time.perf_counter() - chunk_start:.2f}s: "
+                f"{rows_committed} rows written, {rows_rejected} rejected ({progress:.1f}%)."
+            )
+            self.status_label.config(
+                text=f"Status: {rows_committed} rows written, {rows_rejected} rejected ({progress:.1f}%)..."
+            )
+            self.update_idletasks()
+
+        # Everything is in, the checkpoint is no longer needed
+        with engine.connect() as connection:
+            with connection.begin():
+                if sort_in_database:
+                    self.status_label.config(text=f"Status: Sorting rows by {layout}...")
+                    self.update_idletasks()
+                    sort_start = time.perf_counter()
+                    copy_in_key_order(connection, load_table, write_table)
+                    print(
+                        f"Rows sorted by {layout} in {time.perf_counter() - sort_start:.2f}s."
+                    )
+                delete_checkpoint(connection, write_table)
+        if rows_rejected:
+            print(f"{rows_rejected} rejected rows were written to '{reject_path}'.")
+        else:
+            os.remove(reject_path)
+        print(f"Chunked import finished: {rows_committed} rows written.")
+
     # Method to start the import process (triggered by "Start Import" button)
     def start_import(self):
         # Retrieve values from GUI entry widgets
@@ -172,6 +891,12 @@ class RootWindow(tk.Tk):
         port = self.database_port_entry.get()
         database_name = self.database_database_name_entry.get()
         output_table = self.output_table_entry.get()
+        layout = self.layout_combobox.get()
+        index_option = self.index_combobox.get()
+        partition_option = self.partition_combobox.get()
+        chunk_size_text = self.chunk_size_entry.get().strip() or "0"
+        resume_import = self.resume_import_var.get()
+        keep_partitions = self.keep_partitions_var.get()
 
         # List of required input values and corresponding error messages
         required_inputs = [
@@ -189,6 +914,26 @@ class RootWindow(tk.Tk):
                 messagebox.showerror("Input Error", error_message)
                 return  # Stop the process if any required input is missing
 
+        # CLUSTER rewrites the table in the order of an index, and only GIST can be used for that
+        if layout == LAYOUT_CLUSTER and index_option == INDEX_BRIN:
+            messagebox.showerror(
+                "Input Error",
+                "CLUSTER needs a GIST index. Choose 'GIST' or 'GIST + BRIN', or use a curve sort.",
+            )
+            return
+
+        if not chunk_size_text.isdigit():
+            messagebox.showerror(
+                "Input Error", "Chunk size must be a whole number (0 = no chunking)."
+            )
+            return
+        chunk_size = int(chunk_size_text)
+        if resume_import and not chunk_size:
+            messagebox.showerror(
+                "Input Error", "Resuming an import needs a chunk size greater than 0."
+            )
+            return
+
         # Build the database connection string (using f-string for clarity)
         # Handle case where password might be empty
         if password:
@@ -207,6 +952,9 @@ class RootWindow(tk.Tk):
             f"Attempting to connect to: postgresql://{username}@{host}:{port}/{database_name} (password hidden)"
         )
         print(f"Output table name: {output_table}")
+        print(
+            f"Layout: {layout} | Index: {index_option} | Partition by: {partition_option}"
+        )
 
         # --- Database Connection, Data Loading, and Writing ---
         try:
@@ -222,77 +970,153 @@ class RootWindow(tk.Tk):
             self.status_label.config(text="Status: Database connected!")
             self.update_idletasks()
 
-            # 2. Read CSV file
-            self.status_label.config(text=f"Status: Reading CSV file: {csv_path}...")
-            self.update_idletasks()
-            df = pd.read_csv(csv_path)
-            print(f"CSV file loaded. Read {len(df)} rows.")
-            self.status_label.config(
-                text=f"Status: CSV file loaded. Read {len(df)} rows."
-            )
-            self.update_idletasks()
+            # Vector mode: shapefiles etc. are reprojected, repaired and subdivided instead
+            if is_vector_file(csv_path):
 
-            # 3. Convert to GeoDataFrame
-            self.status_label.config(text=f"Status: Converting to GeoDataFrame...")
-            self.update_idletasks()
-            # Create GeoDataFrame using df, geometry from x/y, and CRS
-            # Assumes 'x' and 'y' columns exist and contain valid numerical coordinates
-            geo_data_frame = geopandas.GeoDataFrame(
-                df,
-                geometry=geopandas.points_from_xy(
-                    df.x, df.y
-                ),  # Create Point geometry from x, y columns
-                crs="EPSG:4326",  # Set Coordinate Reference System to WGS84
-            )
-            print("Conversion to GeoDataFrame complete.")
-            self.status_label.config(text=f"Status: Converted to GeoDataFrame.")
-            self.update_idletasks()
+                def show_status(message):
+                    print(message)
+                    self.status_label.config(text=f"Status: {message}")
+                    self.update_idletasks()
 
-            # 4. Write data to PostGIS database table
-            self.status_label.config(
-                text=f"Status: Writing data to table '{output_table}'..."
-            )
-            self.update_idletasks()
-            print(f"Writing data to table '{output_table}' in PostGIS...")
-
-            # Use to_postgis to write the GeoDataFrame to the database
-            # name: The name of the output table
-            # con: The SQLAlchemy engine for connection
-            # if_exists: How to handle existing table ('replace', 'append', 'fail')
-            # index: Whether to write DataFrame index as a database column
-            geo_data_frame.to_postgis(
-                name=output_table,
-                con=engine,
-                if_exists="replace",  # Replace table if it already exists
-                index=False,
+                feature_count = import_vector_file(
+                    engine, csv_path, output_table, show_status
+                )
+                self.status_label.config(text="Status: Data import complete!")
+                messagebox.showinfo(
+                    "Import Successful",
+                    f"{feature_count} features have been successfully imported to the database!",
+                )
+                print("\n--- Import Process Completed Successfully ---")
+                return
+
+            # Partitioned tables can't be created by to_postgis, so the data is written to a
+            # staging table first and then moved into the partitioned table.
+            partition_columns = partition_columns_for(partition_option)
+            csv_columns = pd.read_csv(csv_path, nrows=0).columns
+            missing_columns = [
+                col for col in ["x", "y"] + partition_columns if col not in csv_columns
+            ]
+            if missing_columns:
+                raise KeyError(missing_columns)
+            write_table = (
+                f"{output_table}__staging" if partition_columns else output_table
             )
+
+            if chunk_size:
+                # 2-5. Chunked, checkpointed import (bad rows go to a reject file)
+                self.import_csv_in_chunks(
+                    engine, csv_path, write_table, layout, chunk_size, resume_import
+                )
+            else:
+                # 2. Read CSV file
+                self.status_label.config(
+                    text=f"Status: Reading CSV file: {csv_path}..."
+                )
+                self.update_idletasks()
+                df = pd.read_csv(csv_path)
+                print(f"CSV file loaded. Read {len(df)} rows.")
+                self.status_label.config(
+                    text=f"Status: CSV file loaded. Read {len(df)} rows."
+                )
+                self.update_idletasks()
+
+                # 3. Convert to GeoDataFrame
+                self.status_label.config(text=f"Status: Converting to GeoDataFrame...")
+                self.update_idletasks()
+                # Create GeoDataFrame using df, geometry from x/y, and CRS
+                # Assumes 'x' and 'y' columns exist and contain valid numerical coordinates
+                geo_data_frame = geopandas.GeoDataFrame(
+                    df,
+                    geometry=geopandas.points_from_xy(
+                        df.x, df.y
+                    ),  # Create Point geometry from x, y columns
+                    crs="EPSG:4326",  # Set Coordinate Reference System to WGS84
+                )
+                print("Conversion to GeoDataFrame complete.")
+                self.status_label.config(text=f"Status: Converted to GeoDataFrame.")
+                self.update_idletasks()
+
+                # 4. Sort rows along a space-filling curve so nearby points share pages
+                if layout in CURVE_SORT_LAYOUTS:
+                    self.status_label.config(text=f"Status: Applying {layout}...")
+                    self.update_idletasks()
+                    sort_start = time.perf_counter()
+                    geo_data_frame = spatially_sort(geo_data_frame, layout)
+                    print(
+                        f"Rows sorted by {layout} in {time.perf_counter() - sort_start:.2f}s."
+                    )
+
+                # 5. Write data to PostGIS database table
+                self.status_label.config(
+                    text=f"Status: Writing data to table '{output_table}'..."
+                )
+                self.update_idletasks()
+                print(f"Writing data to table '{output_table}' in PostGIS...")
+
+                # Use to_postgis to write the GeoDataFrame to the database
+                # name: The name of the output table
+                # con: The SQLAlchemy engine for connection
+                # if_exists: How to handle existing table ('replace', 'append', 'fail')
+                # index: Whether to write DataFrame index as a database column
+                geo_data_frame.to_postgis(
+                    name=write_table,
+                    con=engine,
+                    if_exists="replace",  # Replace table if it already exists
+                    index=False,
+                )
+
+            if partition_columns:
+                self.status_label.config(
+                    text=f"Status: Partitioning table by {partition_option}..."
+                )
+                self.update_idletasks()
+                with engine.connect() as connection:
+                    with connection.begin():
+                        create_partitioned_table(
+                            connection,
+                            output_table,
+                            write_table,
+                            partition_columns,
+                            keep_partitions,
+                        )
+
             print(f"Data successfully written to table '{output_table}'.")
             self.status_label.config(
                 text=f"Status: Data written to table '{output_table}'."
             )
             self.update_idletasks()
 
-            # 5. Create Spatial Index (Optional but Recommended for performance)
+            # 6. Create Spatial Index (Optional but Recommended for performance)
             self.status_label.config(text="Status: Creating spatial index...")
             self.update_idletasks()
-            print("Creating spatial index for geometry column...")
-
-            # SQL command to create a GiST index on the geometry column
-            # IF NOT EXISTS prevents error if index already exists
-            index_sql = f"""
-            CREATE INDEX IF NOT EXISTS "{output_table}_geom_idx"
-            ON public."{output_table}" -- Assuming default 'public' schema
-            USING GIST (geometry); 
-            """
-            # Execute the SQL command within a transaction for safety
+            print(f"Creating {index_option} spatial index for geometry column...")
+
+            # Execute the SQL commands within a transaction for safety
             with engine.connect() as connection:
                 with connection.begin():
-                    connection.execute(text(index_sql))
+                    gist_index_name = create_spatial_indexes(
+                        connection, output_table, index_option
+                    )
 
             print("Spatial index created successfully.")
             self.status_label.config(text="Status: Spatial index created.")
             self.update_idletasks()
 
+            # 7. CLUSTER rewrites the table in GIST index order (done after loading)
+            if layout == LAYOUT_CLUSTER:
+                self.status_label.config(text="Status: Clustering table...")
+                self.update_idletasks()
+                print(f"Clustering table '{output_table}' on '{gist_index_name}'...")
+                clustered_count = cluster_table(engine, output_table, gist_index_name)
+                print(f"Table clustered successfully ({clustered_count} table(s)).")
+
+            # 8. Refresh planner statistics so the new layout/index is used right away
+            with engine.connect() as connection:
+                with connection.begin():
+                    connection.execute(text(f'ANALYZE public."{output_table}";'))
+                    # Query caches see every later change to the table (and new partitions)
+                    install_version_triggers(connection, output_table)
+
             # --- All steps completed successfully ---
             self.status_label.config(text="Status: Data import complete!")
             messagebox.showinfo(
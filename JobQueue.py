@@ -0,0 +1,316 @@
+# Import necessary libraries
+import json  # For storing params and results as jsonb
+import threading  # For the lock protecting the local job table and the heartbeat thread
+import traceback  # For logging job failures
+import uuid  # For job ids
+from concurrent.futures import ThreadPoolExecutor  # Local worker pool
+from sqlalchemy import text  # For executing plain SQL
+
+# --- Job Queue Configuration ---
+# Country-scale analyses (coverage of all hospitals, population of every admin polygon, ...)
+# take far longer than a request may stay open behind the proxy. They are submitted as jobs
+# instead: the API returns a job id immediately, a local worker pool runs the jobs with
+# bounded concurrency, and results are kept for a while to be fetched via /jobs/{id}.
+# A job runs in the worker process that accepted it, but its state, progress and result are
+# written to public.analysis_jobs, so a poll answered by any other uvicorn worker finds it
+# and a finished result survives a restart. No external broker is needed.
+# A process restart does lose the jobs it was still running: every process refreshes the
+# heartbeat of its unfinished jobs, and jobs whose heartbeat has stopped are marked failed.
+# That cleanup (and dropping expired results) runs in the heartbeat thread, not on every
+# submit or poll, so requests don't each pay for a write transaction.
+JOB_TABLE_NAME = "analysis_jobs"
+DEFAULT_MAX_WORKERS = 2  # Jobs running at the same time (per process)
+DEFAULT_MAX_PENDING = 20  # Queued + running jobs accepted (per process) before new submissions are refused
+DEFAULT_RESULT_TTL_SECONDS = 3600  # Finished jobs (and their results) are kept this long
+HEARTBEAT_SECONDS = 30  # How often a process confirms its unfinished jobs are still alive
+STALE_HEARTBEAT_SECONDS = 4 * HEARTBEAT_SECONDS  # Unfinished jobs silent this long are marked failed
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+SQL_CREATE_JOB_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS public."{JOB_TABLE_NAME}" (
+        id text PRIMARY KEY,
+        kind text NOT NULL,
+        params jsonb NOT NULL,
+        state text NOT NULL,
+        progress double precision NOT NULL DEFAULT 0,
+        message text,
+        result jsonb,
+        error text,
+        created_at timestamptz NOT NULL DEFAULT now(),
+        started_at timestamptz,
+        finished_at timestamptz,
+        heartbeat_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+SQL_INSERT_JOB = f"""
+    INSERT INTO public."{JOB_TABLE_NAME}" (id, kind, params, state, message)
+    VALUES (:id, :kind, CAST(:params AS jsonb), :state, :message);
+"""
+SQL_SELECT_JOB = f"""
+    SELECT id, kind, params, state, progress, message, error,
+           extract(epoch FROM created_at), extract(epoch FROM started_at),
+           extract(epoch FROM finished_at), {{result}}
+    FROM public."{JOB_TABLE_NAME}"
+    WHERE id = :id;
+"""
+SQL_FAIL_STALE_JOBS = f"""
+    UPDATE public."{JOB_TABLE_NAME}"
+    SET state = '{JOB_FAILED}', error = 'The worker running the job stopped.',
+        message = 'Failed.', finished_at = now()
+    WHERE state IN ('{JOB_QUEUED}', '{JOB_RUNNING}')
+      AND heartbeat_at < now() - make_interval(secs => :stale_seconds);
+"""
+SQL_DELETE_EXPIRED_JOBS = f"""
+    DELETE FROM public."{JOB_TABLE_NAME}"
+    WHERE finished_at < now() - make_interval(secs => :ttl_seconds);
+"""
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already queued or running."""
+
+
+class Job:
+    """State of one job. 'progress' runs from 0.0 to 1.0."""
+
+    def __init__(self, kind, params, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.state = JOB_QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a free worker..."
+        self.result = None
+        self.error = None
+        self.created_at = None
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Job from a row of SQL_SELECT_JOB."""
+        job = cls(row[1], row[2], job_id=row[0])
+        job.state, job.progress, job.message, job.error = row[3], row[4], row[5], row[6]
+        job.created_at, job.started_at, job.finished_at = (
+            float(timestamp) if timestamp is not None else None for timestamp in row[7:10]
+        )
+        job.result = row[10]
+        return job
+
+    def status(self):
+        """JSON-ready status (without the result itself)."""
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Job queue: bounded local worker pool, progress reporting and a TTL result store in the database."""
+
+    def __init__(
+        self,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_pending=DEFAULT_MAX_PENDING,
+        result_ttl_seconds=DEFAULT_RESULT_TTL_SECONDS,
+    ):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job-worker"
+        )
+        self.max_pending = max_pending
+        self.result_ttl_seconds = result_ttl_seconds
+        self.active_jobs = {}  # Unfinished jobs of this process, by id
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    def ensure_job_table(self, engine):
+        """Create the job table if it doesn't exist yet."""
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(text(SQL_CREATE_JOB_TABLE))
+
+    def submit(self, engine, kind, function, params=None):
+        """
+        Queue 'function(params, report_progress)' as a job and return the Job.
+        report_progress(fraction, message) updates the job's progress.
+        Raises QueueFullError if max_pending jobs are already queued or running in this process.
+        """
+        with self.lock:
+            if len(self.active_jobs) >= self.max_pending:
+                raise QueueFullError(
+                    f"{len(self.active_jobs)} jobs are already queued or running, try again later."
+                )
+            job = Job(kind, params or {})
+            self.active_jobs[job.id] = job
+        try:
+            with engine.connect() as connection:
+                with connection.begin():
+                    connection.execute(
+                        text(SQL_INSERT_JOB),
+                        {
+                            "id": job.id,
+                            "kind": kind,
+                            "params": json.dumps(job.params),
+                            "state": job.state,
+                            "message": job.message,
+                        },
+                    )
+        except Exception:
+            with self.lock:
+                del self.active_jobs[job.id]
+            raise
+        self.start_heartbeat(engine)
+        self.executor.submit(self.run_job, engine, job, function)
+        print(f"Job {job.id} ({kind}) queued.")
+        return job
+
+    def store_job(self, engine, job, started=False, finished=False):
+        """
+        Write the state, progress and message of a job (and its result or error once it has
+        finished). 'started' / 'finished' set started_at / finished_at to the database time.
+        """
+        assignments = "state = :state, progress = :progress, message = :message, heartbeat_at = now()"
+        if started:
+            assignments += ", started_at = now()"
+        if finished:
+            assignments += ", result = CAST(:result AS jsonb), error = :error, finished_at = now()"
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(
+                    text(f'UPDATE public."{JOB_TABLE_NAME}" SET {assignments} WHERE id = :id;'),
+                    {
+                        "id": job.id,
+                        "state": job.state,
+                        "progress": job.progress,
+                        "message": job.message,
+                        "result": json.dumps(job.result) if job.result is not None else None,
+                        "error": job.error,
+                    },
+                )
+
+    def run_job(self, engine, job, function):
+        job.state = JOB_RUNNING
+        job.message = "Running..."
+
+        def report_progress(fraction, message=None):
+            job.progress = min(max(float(fraction), 0.0), 1.0)
+            if message:
+                job.message = message
+            self.store_job(engine, job)
+
+        try:
+            self.store_job(engine, job, started=True)
+            job.result = function(job.params, report_progress)
+            job.progress = 1.0
+            job.message = "Done."
+            job.state = JOB_SUCCEEDED
+            self.store_job(engine, job, finished=True)
+            print(f"Job {job.id} ({job.kind}) finished.")
+        except Exception as e:
+            job.result = None
+            job.error = str(e)
+            job.message = "Failed."
+            job.state = JOB_FAILED
+            print(f"ERROR: Job {job.id} ({job.kind}) failed: {e}")
+            traceback.print_exc()
+            try:
+                self.store_job(engine, job, finished=True)
+            except Exception as store_error:
+                # The heartbeat stops with the job, so it is marked failed once it goes stale
+                print(f"ERROR: Could not store the failure of job {job.id}: {store_error}")
+        finally:
+            with self.lock:
+                self.active_jobs.pop(job.id, None)
+
+    def get(self, engine, job_id, with_result=False):
+        """
+        Return the Job for 'job_id' (with its result if 'with_result'), or None if it is
+        unknown or has expired. Works for jobs submitted to any process.
+        """
+        with engine.connect() as connection:
+            row = connection.execute(
+                text(SQL_SELECT_JOB.format(result="result" if with_result else "NULL")),
+                {"id": job_id},
+            ).first()
+        return Job.from_row(row) if row else None
+
+    def expire_old_jobs(self, engine):
+        """Mark jobs of stopped processes as failed and drop finished jobs older than the result TTL."""
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(
+                    text(SQL_FAIL_STALE_JOBS), {"stale_seconds": STALE_HEARTBEAT_SECONDS}
+                )
+                connection.execute(
+                    text(SQL_DELETE_EXPIRED_JOBS), {"ttl_seconds": self.result_ttl_seconds}
+                )
+
+    def start_heartbeat(self, engine):
+        """
+        Start the thread refreshing the heartbeat of this process's unfinished jobs and expiring
+        old jobs (once per process; later calls do nothing).
+        """
+        with self.lock:
+            if self.heartbeat_thread is not None:
+                return
+            self.heartbeat_thread = threading.Thread(
+                target=self.heartbeat, args=(engine,), name="job-heartbeat", daemon=True
+            )
+        self.heartbeat_thread.start()
+
+    def heartbeat(self, engine):
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            with self.lock:
+                job_ids = list(self.active_jobs)
+            try:
+                if job_ids:
+                    with engine.connect() as connection:
+                        with connection.begin():
+                            connection.execute(
+                                text(
+                                    f'UPDATE public."{JOB_TABLE_NAME}" SET heartbeat_at = now() '
+                                    "WHERE id = ANY(:ids);"
+                                ),
+                                {"ids": job_ids},
+                            )
+                self.expire_old_jobs(engine)
+            except Exception as e:
+                print(f"WARNING: Job heartbeat failed: {e}")
+
+    def shutdown(self, engine=None):
+        """Stop the workers; jobs this process had not finished are marked failed."""
+        self.stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            job_ids = list(self.active_jobs)
+        if engine is None or not job_ids:
+            return
+        try:
+            with engine.connect() as connection:
+                with connection.begin():
+                    connection.execute(
+                        text(
+                            f'UPDATE public."{JOB_TABLE_NAME}" '
+                            "SET state = :state, error = :error, message = 'Failed.', finished_at = now() "
+                            "WHERE id = ANY(:ids) AND finished_at IS NULL;"
+                        ),
+                        {
+                            "state": JOB_FAILED,
+                            "error": "The server stopped before the job finished.",
+                            "ids": job_ids,
+                        },
+                    )
+        except Exception as e:
+            print(f"WARNING: Could not mark unfinished jobs as failed: {e}")
@@ -1,18 +1,78 @@
 # Import necessary libraries
-import geopandas as gpd  # For reading geospatial data from PostGIS into a GeoDataFrame
+import asyncio  # For running the warm-up in the background
+import json  # For passing GeoJSON polygons to PostGIS
+import os  # For checking whether the tile archive exists
+import time  # For timing the warm-up
+from contextlib import asynccontextmanager  # For the startup / shutdown lifespan hook
 from sqlalchemy import (
     create_engine,
     text,
 )  # For creating a database engine and executing SQL text
+from sqlalchemy.exc import DBAPIError  # For recognizing cancelled statements
 from fastapi import (
     FastAPI,
     HTTPException,
-)  # FastAPI for API creation, HTTPException for error responses
+    Request,
+    Response,
+)  # FastAPI for API creation, HTTPException for error responses, Response for raw tile bytes
 from fastapi.middleware.cors import CORSMiddleware  # For Cross-Origin Resource Sharing
-from pydantic import BaseModel
+from fastapi.responses import (
+    FileResponse,
+    StreamingResponse,
+)  # For serving the shared layer files and the hospital change stream
+from pydantic import BaseModel, Field
+from ExportTiles import MBTilesArchive  # Read-only access to the pre-rendered tile pyramid
+from HospitalIndex import HospitalIndex  # In-memory STRtree for nearest-hospital queries
+from JobQueue import (
+    JOB_FAILED,
+    JOB_SUCCEEDED,
+    JobQueue,
+    QueueFullError,
+)  # Local queue for long-running analyses
+from SharedLayers import SharedLayers  # Reference layers memory-mapped by all workers
+from HospitalChanges import (
+    CHANGE_POLL_SECONDS,
+    HospitalChangeFeed,
+    format_cursor,
+    parse_cursor,
+)  # Live hospital deltas (Server-Sent Events)
+from AdmissionControl import (
+    ConcurrencyLimiter,
+    WaitQueueFullError,
+    WaitTimeoutError,
+)  # Per-endpoint concurrency limits
+from Cohorts import (
+    cohort_columns,
+    cohort_weight_sql,
+    get_table_columns,
+)  # Demographic cohort weights (e.g. "under5", "f_15..45", "f_0+m_0")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup: warm the worker up in the background (see warm_up); /ready reports when it is done.
+    Shutdown: stop the job workers (marking their unfinished jobs failed) and release the tile
+    archive and the connection pool.
+    """
+    background_tasks = [
+        asyncio.create_task(warm_up_until_ready()),
+        asyncio.create_task(watch_reference_layers()),
+        asyncio.create_task(broadcast_hospital_changes()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    job_queue.shutdown(engine)
+    if tile_archive is not None:
+        tile_archive.close()
+    if engine is not None:
+        engine.dispose()
+        print("Database engine disposed.")
+
 
 # Initialize FastAPI app
-app = FastAPI()  # Server start command :  uvicorn MainApi:app --reload
+app = FastAPI(lifespan=lifespan)  # Server start command :  uvicorn MainApi:app --reload
 
 
 class HospitalCreate(BaseModel):
@@ -23,9 +83,47 @@ class HospitalCreate(BaseModel):
 
 
 class AnalysisData(BaseModel):
+    # Circle / rings around a point
+    latitude: float | None = None
+    longitude: float | None = None
+    radius_meters: int | None = None
+    # Concentric rings, e.g. [1000, 2000, 5000] -> 0-1 km, 1-2 km, 2-5 km
+    ring_radii_meters: list[int] | None = None
+    # Custom service area (GeoJSON Polygon / MultiPolygon geometry)
+    polygon: dict | None = None
+    # Admin polygon (gid in the analysis polygons table)
+    admin_area_id: int | None = None
+    # Year (and optionally country) of the multi-year dataset; without a year the
+    # single-year POPULATION_TABLE_NAME is used
+    year: int | None = None
+    country: str | None = None
+    # Demographic cohort to count instead of TotalPopulation (see Cohorts.py),
+    # e.g. "under5", "over65", "f_15..45" or "f_0+f_1+m_0+m_1"
+    cohort: str | None = None
+
+
+class PopulationChangeData(AnalysisData):
+    # Same area fields as AnalysisData (circle, polygon or admin polygon; no rings)
+    from_year: int
+    to_year: int
+
+
+class QueryPoint(BaseModel):
     latitude: float
     longitude: float
+
+
+MAX_NEAREST_BATCH_POINTS = 1000  # Points per batch request (larger batches are rejected with 422)
+
+
+class NearestHospitalsBatch(BaseModel):
+    points: list[QueryPoint] = Field(max_length=MAX_NEAREST_BATCH_POINTS)
+    k: int = 5
+
+
+class CoverageJob(BaseModel):
     radius_meters: int
+    cohort: str | None = None
 
 
 # --- CORS (Cross-Origin Resource Sharing) Middleware Configuration ---
@@ -40,6 +138,9 @@ origins = [
     # "*"                    # For broader development testing (allows all origins)
 ]
 
+# Change cursor of /get_hospitals (see the hospital change feed below)
+HOSPITAL_CHANGE_SEQ_HEADER = "X-Hospital-Change-Seq"
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -52,6 +153,9 @@ app.add_middleware(
     allow_headers=[
         "*"
     ],  # Which HTTP headers are allowed in requests. ["*"] allows all.
+    expose_headers=[
+        HOSPITAL_CHANGE_SEQ_HEADER
+    ],  # Response headers browser JS may read (the cursor for ?after= of the change stream).
 )
 
 # --- Database Connection and Table Configuration ---
@@ -64,6 +168,19 @@ POPULATION_TABLE_NAME = "egy_2020_constrained_UNadj"  # Original population data
 POPULATION_GEOM_COL = "geometry"  # Geometry column for population points
 SQL_QUERY_POPULATION_POINTS = f'SELECT * FROM public."{POPULATION_TABLE_NAME}" LIMIT 50;'  # Query for population points with a limit for now
 
+# Multi-year population data: one table LIST-partitioned by "Year" (or "Country" -> "Year"),
+# built by importing the yearly CSVs with ImportCsvToDatabase.py ("Add to existing table").
+# Requests with a 'year' read from it; the year (and country) filters let PostgreSQL scan only
+# the matching partitions.
+POPULATION_TIME_SERIES_TABLE_NAME = "population_by_year"
+
+# Columns of each population table (table name -> (version marker, set of columns)), read in
+# warm_up and re-read by the reference layer watcher when the table's version changes, so
+# requests never query the catalog. They decide whether a cohort can use a stored
+# "cohort_<name>" column (added with Cohorts.py) or sums its age columns.
+POPULATION_TABLES = [POPULATION_TABLE_NAME, POPULATION_TIME_SERIES_TABLE_NAME]
+population_columns = {}
+
 # Configuration for the analysis polygons data
 ANALYSIS_POLYGONS_TABLE_NAME = (
     "egypt_shape_admin_level2"  # Table name for analysis polygons
@@ -71,7 +188,83 @@ ANALYSIS_POLYGONS_TABLE_NAME = (
 POLYGON_GEOMETRY_COLUMN_NAME = "geom"  # Geometry column for analysis polygons
 SQL_QUERY_ANALYSIS_POLYGONS = f'SELECT * FROM public."{ANALYSIS_POLYGONS_TABLE_NAME}";'  # Query to get all analysis polygons
 
+ANALYSIS_POLYGONS_SUBDIVIDED_TABLE_NAME = f"{ANALYSIS_POLYGONS_TABLE_NAME}_subdivided"  # Created by ImportVectorToDatabase.py
+ANALYSIS_POLYGONS_ID_COLUMN_NAME = "gid"
+# Custom polygons are cut into pieces of at most this many vertices before the point test
+ANALYSIS_POLYGON_SUBDIVIDE_VERTICES = 64
+# Distance tests in metres need geography, but a cast geometry column can't use its GIST index.
+# Every ST_DWithin is therefore preceded by a bounding box test in degrees (see dwithin_sql).
+# One degree of latitude is at least 110574 m; the box uses a smaller value so it is never too small.
+PREFILTER_METERS_PER_DEGREE = 110000
+
 SQL_QUERY_HOSPITAL_DATA = 'SELECT * FROM public."hospitals";'
+
+# Pre-rendered vector tiles (created with: python ExportTiles.py --db ...)
+TILE_ARCHIVE_PATH = "population_tiles.mbtiles"
+tile_archive = None  # Opened at startup (or on first tile request), then reused
+
+# In-memory nearest-hospital index, built from the arrays of the shared layer snapshot
+# (rebuilt whenever a new snapshot is published, e.g. after a hospital insert)
+hospital_index = None
+hospital_index_snapshot = None  # Name of the snapshot hospital_index was built from
+MAX_NEAREST_HOSPITALS = 50  # Upper bound for k
+
+# Long-running analyses run as background jobs (see JobQueue.py). Their state is kept in the
+# database, so any worker can answer /jobs/{id} and results survive a restart.
+job_queue = JobQueue()
+JOB_BATCH_SIZE = 50  # Hospitals / admin polygons per query (progress is reported per batch)
+
+# One engine (and its connection pool) shared by all requests and jobs, created on first use
+engine = None
+DATABASE_POOL_SIZE = 5  # Connections kept open (and warmed up at startup)
+DATABASE_MAX_OVERFLOW = 10  # Extra connections opened under load
+
+# Small reference layers served as pre-serialized GeoJSON: name -> (query, geometry column, table).
+# They are stored once for all uvicorn workers in a memory-mapped snapshot (see SharedLayers.py),
+# together with the hospital index arrays. Every worker compares the version markers of the
+# source tables with the snapshot every LAYER_VERSION_CHECK_SECONDS, so a re-import of either
+# table publishes a new snapshot; a hospital insert publishes one right away. Only the layers
+# whose table changed are read again, the others are taken over from the previous snapshot.
+REFERENCE_LAYERS = {
+    "polygons": (SQL_QUERY_ANALYSIS_POLYGONS, POLYGON_GEOMETRY_COLUMN_NAME, ANALYSIS_POLYGONS_TABLE_NAME),
+    "hospitals": (SQL_QUERY_HOSPITAL_DATA, "geom", "hospitals"),
+}
+REFERENCE_TABLES = [table for _, _, table in REFERENCE_LAYERS.values()]
+LAYER_VERSION_CHECK_SECONDS = 30
+shared_layers = SharedLayers()
+
+# Inserted / updated / deleted hospitals are pushed to clients of /api/hospitals/changes.
+# /get_hospitals sends the change cursor ("<txid>:<seq>") its data is current to in the
+# X-Hospital-Change-Seq header; clients stream the changes after it from there on.
+# (HOSPITAL_CHANGE_SEQ_HEADER is defined with the CORS settings, which expose it.)
+hospital_changes = HospitalChangeFeed()
+CHANGE_LOG_PRUNE_SECONDS = 3600
+
+# --- Admission Control ---
+# Analyses run in worker threads, at most ANALYSIS_MAX_CONCURRENT at a time (fewer than the
+# pooled connections, so cheap endpoints always find one). A few more requests may wait
+# briefly for a slot; the rest are refused at once with 429 (queue full) or 503 (waited too long).
+ANALYSIS_MAX_CONCURRENT = 4
+ANALYSIS_MAX_WAITING = 8
+ANALYSIS_MAX_WAIT_SECONDS = 5
+analysis_limiter = ConcurrencyLimiter(
+    "analysis", ANALYSIS_MAX_CONCURRENT, ANALYSIS_MAX_WAITING, ANALYSIS_MAX_WAIT_SECONDS
+)
+RETRY_AFTER_SECONDS = 5  # Sent in the Retry-After header of refused requests
+# Every analysis statement is cancelled by the server after this long (jobs get more time)
+ANALYSIS_STATEMENT_TIMEOUT_SECONDS = 30
+JOB_STATEMENT_TIMEOUT_SECONDS = 3600
+# Circles and rings read only the points in the index box around their center (see dwithin_sql),
+# so the radius bounds the rows a direct analysis reads; larger ones must go through /jobs/analysis.
+# Polygon and admin-area analyses are bounded by their area and the statement timeout only.
+MAX_ANALYSIS_RADIUS_METERS = 50000
+DISCONNECT_POLL_SECONDS = 0.5  # How often a running analysis checks whether the client left
+PG_QUERY_CANCELED = "57014"  # SQLSTATE of statements stopped by statement_timeout or cancel()
+
+# Startup warm-up (see warm_up); /ready returns 503 until it has finished
+WARM_UP_RETRY_SECONDS = 10  # Wait between attempts when the database isn't reachable yet
+WARM_UP_POINT = (31.2357, 30.0444)  # lon/lat used for the warm-up analysis queries (Cairo)
+warm_up_status = {"ready": False, "seconds": None, "error": None, "warnings": []}
 # --- API Endpoints ---
 
 
@@ -84,36 +277,314 @@ async def read_root():
     return {"message": "Hello FastAPI! Your GIS API is running."}
 
 
+@app.get("/ready")
+async def readiness():
+    """
+    Readiness check for the load balancer: 503 until the startup warm-up has finished.
+    """
+    if not warm_up_status["ready"]:
+        raise HTTPException(status_code=503, detail=warm_up_status)
+    return {**warm_up_status, "analysis": analysis_limiter.status()}
+
+
+def get_engine():
+    """
+    Return the shared database engine, creating it (and its connection pool) on first use.
+    """
+    global engine
+    if engine is None:
+        engine = create_engine(
+            DATABASE_CONNECTION_STRING,
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_pre_ping=True,  # Replace connections the server has dropped
+        )
+    return engine
+
+
+def reference_table_versions():
+    """
+    Version markers of the tables the reference layers are read from.
+    """
+    from QueryCache import table_version  # Deferred: QueryCache pulls in GeoPandas
+
+    with get_engine().connect() as connection:
+        return {table: table_version(connection, table) for table in REFERENCE_TABLES}
+
+
+def install_reference_version_triggers():
+    """
+    Install the version triggers on the reference tables (see QueryCache.py), so the version
+    check sees every write. Without them (e.g. the API's role doesn't own the tables) the
+    check falls back to a checksum. Returns warnings.
+    """
+    from QueryCache import install_version_triggers
+
+    warnings = []
+    for table in REFERENCE_TABLES:
+        try:
+            with get_engine().connect() as connection:
+                with connection.begin():
+                    install_version_triggers(connection, table)
+        except Exception as e:
+            warnings.append(f"No version trigger on '{table}', versions use a checksum: {str(e)}")
+    return warnings
+
+
+def publish_reference_layers(refresh=()):
+    """
+    Publish a new shared snapshot if the version of a source table has changed (or a layer is
+    named in 'refresh'). Only those layers are read from PostGIS and serialized again (with the
+    hospital index arrays if the hospitals are among them); the others are taken over from the
+    current snapshot. Returns the current snapshot.
+    Blocking: call it from a worker thread, not from the event loop.
+    """
+    import geopandas as gpd  # Deferred: only the GeoJSON endpoints need GeoPandas
+
+    versions = reference_table_versions()
+    snapshot = shared_layers.load()
+    stale_layers = [
+        name
+        for name, (_, _, table) in REFERENCE_LAYERS.items()
+        if snapshot is None
+        or name in refresh
+        or name not in snapshot.files
+        or snapshot.versions.get(table) != versions[table]
+    ]
+    if not stale_layers:
+        return snapshot
+
+    files = {}
+    if "hospitals" in stale_layers:
+        # Read before the layers: changes made while they are read are streamed again (harmless)
+        change_seq = format_cursor(hospital_changes.current_cursor(get_engine()))
+        index = HospitalIndex.from_database(get_engine())
+        arrays = index.arrays()
+        extras = {"hospital_names": index.names, "hospital_change_seq": change_seq}
+    else:
+        arrays = {array_name: values for array_name, values in snapshot.arrays.items()}
+        extras = snapshot.extras
+    for name in stale_layers:
+        sql, geom_col, _ = REFERENCE_LAYERS[name]
+        gdf = gpd.read_postgis(
+            sql=text(sql), con=get_engine(), geom_col=geom_col, crs="EPSG:4326"
+        )
+        files[name] = gdf.to_json().encode()
+        print(f"Reference layer '{name}' loaded: {len(gdf)} features.")
+    reused_files = {
+        name: snapshot.file_path(name) for name in REFERENCE_LAYERS if name not in files
+    }
+    shared_layers.publish(
+        versions, files=files, arrays=arrays, extras=extras, reused_files=reused_files
+    )
+    return shared_layers.load()
+
+
+def get_layer_snapshot():
+    """
+    Return the current shared snapshot, publishing one if no worker has done so yet.
+    Blocking on first use: async endpoints go through get_layer_snapshot_async.
+    """
+    snapshot = shared_layers.load()
+    if snapshot is None:
+        try:
+            snapshot = publish_reference_layers()
+        except Exception as e:
+            error_message = f"An error occurred while loading the reference layers: {str(e)}"
+            print(f"ERROR: {error_message}")
+            raise HTTPException(status_code=500, detail=error_message)
+    return snapshot
+
+
+async def get_layer_snapshot_async():
+    """
+    get_layer_snapshot for the event loop: the usual case (a snapshot is already published)
+    costs one stat(); publishing the first one runs in a worker thread.
+    """
+    snapshot = shared_layers.load()
+    if snapshot is None:
+        snapshot = await asyncio.to_thread(get_layer_snapshot)
+    return snapshot
+
+
+async def get_reference_response(name):
+    """
+    Return the GeoJSON response of a reference layer, streamed from the shared snapshot file.
+    """
+    snapshot = await get_layer_snapshot_async()
+    headers = {}
+    if "hospital_change_seq" in snapshot.extras:
+        headers[HOSPITAL_CHANGE_SEQ_HEADER] = str(snapshot.extras["hospital_change_seq"])
+    return FileResponse(
+        snapshot.file_path(name), media_type="application/json", headers=headers
+    )
+
+
+async def watch_reference_layers():
+    """
+    Publish a new snapshot whenever the version of a source table changes (an import,
+    a hospital added by another worker, ...). Workers that find the snapshot up to date do nothing.
+    """
+    while True:
+        await asyncio.sleep(LAYER_VERSION_CHECK_SECONDS)
+        if not warm_up_status["ready"]:
+            continue
+        try:
+            await asyncio.to_thread(publish_reference_layers)
+            # Tables that can't be read were already reported by warm_up
+            await asyncio.to_thread(refresh_population_columns)
+        except Exception as e:
+            print(f"WARNING: Reference layer version check failed: {str(e)}")
+
+
+def warm_up_connections():
+    """
+    Open every pooled connection and plan the analysis queries on it, so the first requests
+    find open connections with the catalog and statistics of the tables already cached.
+    The circle query is executed once (with a tiny radius, so it reads a few index pages
+    through the prefilter of dwithin_sql) to pull the upper index pages into memory.
+    """
+    warnings = []
+    longitude, latitude = WARM_UP_POINT
+    point_input = AnalysisData(latitude=latitude, longitude=longitude, radius_meters=1)
+    plan_inputs = [
+        AnalysisData(latitude=latitude, longitude=longitude, ring_radii_meters=[1, 2]),
+        AnalysisData(admin_area_id=0),
+        AnalysisData(
+            polygon={
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [longitude, latitude],
+                        [longitude + 0.001, latitude],
+                        [longitude, latitude + 0.001],
+                        [longitude, latitude],
+                    ]
+                ],
+            }
+        ),
+    ]
+    connections = [get_engine().connect() for _ in range(DATABASE_POOL_SIZE)]
+    try:
+        set_statement_timeout(connections[0], ANALYSIS_STATEMENT_TIMEOUT_SECONDS)
+        run_analysis(connections[0], point_input)
+        connections[0].rollback()
+        for connection in connections:
+            for data_input in [point_input] + plan_inputs:
+                sql, params, kind = build_analysis_query(data_input)
+                try:
+                    with connection.begin_nested():
+                        connection.execute(text("EXPLAIN " + sql.strip().rstrip(";")), params)
+                except Exception as e:
+                    warnings.append(f"Could not plan the {kind} query: {str(e)}")
+            connection.rollback()
+    finally:
+        for connection in connections:
+            connection.close()
+    return sorted(set(warnings))
+
+
+def warm_up():
+    """
+    Get this worker ready for traffic: open the pool, map (or publish) the shared reference
+    layers, build the hospital index, open the tile archive and warm the query plans.
+    """
+    start = time.perf_counter()
+    warnings = []
+    hospital_changes.ensure_change_log(get_engine())
+    job_queue.ensure_job_table(get_engine())
+    job_queue.start_heartbeat(get_engine())  # Also expires old jobs, for every worker
+    warnings += install_reference_version_triggers()
+    publish_reference_layers()
+    get_hospital_index()
+    warnings += refresh_population_columns()  # Cohort requests then find their columns cached
+    if os.path.exists(TILE_ARCHIVE_PATH):
+        get_tile_archive()
+    else:
+        warnings.append(f"Tile archive '{TILE_ARCHIVE_PATH}' not found.")
+    warnings += warm_up_connections()
+    for warning in warnings:
+        print(f"WARNING: {warning}")
+    return warnings, time.perf_counter() - start
+
+
+async def broadcast_hospital_changes():
+    """
+    Poll the hospital change log and push new changes to the connected clients of this worker.
+    """
+    last_prune = time.monotonic()
+    while True:
+        await asyncio.sleep(CHANGE_POLL_SECONDS)
+        if not warm_up_status["ready"]:
+            continue
+        try:
+            changes = await asyncio.to_thread(hospital_changes.poll, get_engine())
+            if changes:
+                hospital_changes.publish(changes)
+            if time.monotonic() - last_prune > CHANGE_LOG_PRUNE_SECONDS:
+                await asyncio.to_thread(hospital_changes.prune, get_engine())
+                last_prune = time.monotonic()
+        except Exception as e:
+            print(f"WARNING: Hospital change poll failed: {str(e)}")
+
+
+async def warm_up_until_ready():
+    """
+    Run warm_up in a worker thread (the event loop keeps serving /ready meanwhile),
+    retrying while the database is unreachable.
+    """
+    while True:
+        try:
+            warnings, seconds = await asyncio.to_thread(warm_up)
+        except Exception as e:
+            warm_up_status["error"] = str(e)
+            print(f"ERROR: Warm-up failed, retrying in {WARM_UP_RETRY_SECONDS}s: {str(e)}")
+            await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+            continue
+        warm_up_status.update(
+            ready=True, seconds=round(seconds, 2), error=None, warnings=warnings
+        )
+        print(f"Warm-up finished in {seconds:.2f}s, ready for traffic.")
+        return
+
+
 @app.get("/get_population_data")
-async def get_population_data():
+async def get_population_data(year: int | None = None, cohort: str | None = None):
     """
     API endpoint to fetch population point data from PostGIS.
     Currently returns a limited number of points due to SQL_QUERY_POPULATION_POINTS.
+    With 'year', the points are read from that year's partition of the multi-year table.
+    With 'cohort', every point also gets a "cohort_population" property computed by the database.
     """
-    engine = None
+    import geopandas as gpd  # Deferred: only the GeoJSON endpoints need GeoPandas
+
     gdf_population = None  # GeoDataFrame for population data
+    sql_query = SQL_QUERY_POPULATION_POINTS
+    query_params = None
+    # Table the points are read from, named in the log and error messages
+    table_name = POPULATION_TABLE_NAME if year is None else POPULATION_TIME_SERIES_TABLE_NAME
+    if year is not None or cohort:
+        columns = "p.*"
+        if cohort:
+            columns += f", {population_weight_sql(cohort, table_name)} AS cohort_population"
+        sql_query = f'SELECT {columns} FROM public."{table_name}" p'
+        if year is not None:
+            sql_query += ' WHERE p."Year" = :year'
+            query_params = {"year": year}
+        sql_query += " LIMIT 50;"
 
     try:
         print("--- Population Data Endpoint: Start ---")
-        print("Attempting to create database engine for population data...")
-        engine = create_engine(DATABASE_CONNECTION_STRING)
-
-        print("Testing database connection for population data...")
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))  # Minimal query to check connectivity
-        print("Database connection successful for population data!")
-
-        print(
-            f"Attempting to read population data from table 'public.{POPULATION_TABLE_NAME}' using query: {SQL_QUERY_POPULATION_POINTS}"
-        )
+        print(f"Attempting to read population data using query: {sql_query}")
         gdf_population = gpd.read_postgis(
-            sql=text(SQL_QUERY_POPULATION_POINTS),
-            con=engine,
+            sql=text(sql_query),
+            con=get_engine(),
+            params=query_params,
             geom_col=POPULATION_GEOM_COL,  # Use defined geometry column name
             crs="EPSG:4326",  # Assuming WGS84
         )
         print(
-            f"Successfully read {len(gdf_population)} population points from table 'public.{POPULATION_TABLE_NAME}'."
+            f"Successfully read {len(gdf_population)} population points from table 'public.{table_name}'."
         )
 
     except Exception as e:
@@ -134,13 +605,13 @@ async def get_population_data():
             gdf_population.__geo_interface__
         )  # Convert GeoDataFrame to GeoJSON-like dictionary
     elif gdf_population is not None and gdf_population.empty:
-        message = f"No population data found in table 'public.{POPULATION_TABLE_NAME}' or query returned no results."
+        message = f"No population data found in table 'public.{table_name}' or query returned no results."
         print(f"INFO: {message}")
         # Return an empty GeoJSON FeatureCollection if no data found
         return {"type": "FeatureCollection", "features": []}
     else:
         # This case should ideally be caught by the exception or the empty check
-        message = f"Failed to read population data from 'public.{POPULATION_TABLE_NAME}', or an unexpected issue occurred."
+        message = f"Failed to read population data from 'public.{table_name}', or an unexpected issue occurred."
         print(f"ERROR: {message}")
         raise HTTPException(
             status_code=404,  # Or 500 if it's an unexpected server state
@@ -154,67 +625,9 @@ async def get_population_data():
 async def get_polygon_data():  # Renamed function to match endpoint and data type
     """
     API endpoint to fetch analysis polygon data from PostGIS.
+    Served from the GeoJSON response loaded at startup.
     """
-    engine = None
-    gdf_polygons = None  # GeoDataFrame for polygon data
-
-    try:
-        print("--- Polygon Data Endpoint: Start ---")
-        print("Attempting to create database engine for polygon data...")
-        engine = create_engine(DATABASE_CONNECTION_STRING)
-
-        print("Testing database connection for polygon data...")
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))  # Minimal query to check connectivity
-        print("Database connection successful for polygon data!")
-
-        print(
-            f"Attempting to read polygon data from table 'public.{ANALYSIS_POLYGONS_TABLE_NAME}' using query: {SQL_QUERY_ANALYSIS_POLYGONS}"
-        )
-        gdf_polygons = gpd.read_postgis(
-            sql=text(SQL_QUERY_ANALYSIS_POLYGONS),
-            con=engine,
-            geom_col=POLYGON_GEOMETRY_COLUMN_NAME,  # Use defined geometry column name for polygons
-            crs="EPSG:4326",  # Assuming WGS84
-        )
-        print(
-            f"Successfully read {len(gdf_polygons)} polygons from table 'public.{ANALYSIS_POLYGONS_TABLE_NAME}'."
-        )
-
-    except Exception as e:
-        error_message = (
-            f"An error occurred during database interaction for polygon data: {str(e)}"
-        )
-        print(f"ERROR: {error_message}")
-        raise HTTPException(
-            status_code=500,
-            detail=error_message,
-        )
-
-    if gdf_polygons is not None and not gdf_polygons.empty:
-        print("Polygon data GeoDataFrame (first 5 rows):")  # Good for a quick check
-        print(gdf_polygons.head())
-        # print("\nPolygon data GeoDataFrame Info:") # .info() can be verbose for API logs
-        # gdf_polygons.info()
-        print("--- Polygon Data Endpoint: Success ---")
-        return (
-            gdf_polygons.__geo_interface__
-        )  # Convert GeoDataFrame to GeoJSON-like dictionary
-    elif gdf_polygons is not None and gdf_polygons.empty:
-        message = (
-            f"No polygon data found in table 'public.{ANALYSIS_POLYGONS_TABLE_NAME}'."
-        )
-        print(f"INFO: {message}")
-        # Return an empty GeoJSON FeatureCollection if no data found
-        return {"type": "FeatureCollection", "features": []}
-    else:
-        # This case implies an issue before data could be assessed as empty, likely caught by the main try-except.
-        message = f"Failed to read polygon data from 'public.{ANALYSIS_POLYGONS_TABLE_NAME}', or an unexpected issue occurred."
-        print(f"ERROR: {message}")
-        raise HTTPException(
-            status_code=404,  # Or 500
-            detail=message,
-        )
+    return await get_reference_response("polygons")
 
 
 @app.post("/api/add_hospital")
@@ -223,9 +636,7 @@ async def add_new_hospital(hospital_input: HospitalCreate):
     print(f"Doctor Count: {hospital_input.doctor_count}")
     print(f"Latitude: {hospital_input.latitude}")
     print(f"Longitude: {hospital_input.longitude}")
-    engine = None
     new_hospital_id = None
-    engine = create_engine(DATABASE_CONNECTION_STRING)
 
     sql_insert_statement = text(
         """
@@ -241,15 +652,19 @@ async def add_new_hospital(hospital_input: HospitalCreate):
         "latitude": hospital_input.latitude,
     }
     try:
-        print("Attempting to create database engine for hospital insertion...")
-        engine = create_engine(DATABASE_CONNECTION_STRING)
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             with connection.begin() as transaction:
                 result = connection.execute(sql_insert_statement, insert_params)
                 new_hospital_id = result.scalar_one_or_none()
                 print(f"Successfully inserted new hospital with ID: {new_hospital_id}")
 
         print("--- Add Hospital Endpoint: Database insertion successful ---")
+        try:
+            # All workers switch to the new snapshot on their next request; the polygons are reused
+            await asyncio.to_thread(publish_reference_layers, ["hospitals"])
+        except Exception as e:
+            # The insert itself succeeded; the periodic version check publishes it later
+            print(f"WARNING: Shared hospital layer could not be republished: {str(e)}")
         return {
             "message": "Hospital added to database successfully!",
             "hospital_id": new_hospital_id,
@@ -262,86 +677,413 @@ async def add_new_hospital(hospital_input: HospitalCreate):
             status_code=500,
             detail=error_message,
         )
-    finally:
-        if engine:
-            engine.dispose()
-            print("Database engine disposed.")
 
 
 @app.get(
     "/get_hospitals"
 )  # Changed from get_populaion_data to get_polygon_data as per your code
 async def get_hospitals():
-    engine = None
-    gdf_hospitals = None
+    """
+    API endpoint returning all hospitals as GeoJSON.
+    Served from the response loaded at startup, reloaded after every insert.
+    Later changes are streamed by /api/hospitals/changes (see the X-Hospital-Change-Seq header).
+    """
+    return await get_reference_response("hospitals")
+
+
+@app.get("/api/hospitals/changes")
+async def hospital_change_stream(request: Request, after: str | None = None):
+    """
+    Server-Sent Events stream of hospital changes ("hospital" events with a "<txid>:<seq>" id).
+    Start from the X-Hospital-Change-Seq of /get_hospitals ('after'); on reconnect the browser's
+    EventSource sends Last-Event-ID and the missed changes are replayed first.
+    """
+    after = request.headers.get("last-event-id") or after
+    after_cursor = None
+    if after:
+        try:
+            after_cursor = parse_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return StreamingResponse(
+        hospital_changes.stream(get_engine(), after_cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def refresh_population_columns():
+    """
+    Read the columns of every population table whose version changed since they were last
+    read (all of them the first time). Blocking: run by warm_up and, in a worker thread, by
+    the reference layer watcher. Returns warnings.
+    """
+    from QueryCache import table_version  # Deferred: QueryCache pulls in GeoPandas
+
+    warnings = []
+    for table in POPULATION_TABLES:
+        try:
+            with get_engine().connect() as connection:
+                # Catalog-only marker, no table scan: adding cohort columns rewrites the table
+                # and a re-import replaces it, both give it a new file id
+                version = table_version(connection, table, version_mode="stats")
+                if table in population_columns and population_columns[table][0] == version:
+                    continue
+                population_columns[table] = (version, get_table_columns(connection, table))
+            print(f"Columns of population table '{table}' loaded.")
+        except Exception as e:
+            warnings.append(f"Columns of population table '{table}' could not be read: {str(e)}")
+    return warnings
+
+
+def get_population_columns(table_name):
+    """
+    Column names of a population table, from the cache filled by refresh_population_columns.
+    Raises HTTPException(503) until they have been read.
+    """
+    if table_name not in population_columns:
+        raise HTTPException(
+            status_code=503,
+            detail=f"The columns of table '{table_name}' are not loaded yet, try again later.",
+        )
+    return population_columns[table_name][1]
+
+
+def population_weight_sql(cohort, table_name):
+    """
+    SQL for the population of each point 'p' of 'table_name': "TotalPopulation", or the
+    requested cohort (its stored column, or the sum of its age columns).
+    Raises HTTPException(422) for an invalid cohort.
+    """
+    if not cohort:
+        return cohort_weight_sql(None, ())
     try:
-        print("--- Get Hospitals Endpoint: Start ---")
-        print("Attempting to create database engine for hospital data...")
-        engine = create_engine(DATABASE_CONNECTION_STRING)
-        print("Testing database connection for hospital data...")
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))
-        print("Database connection successful for hospitals!")
-        print(f"Attempting to read hospital data from table 'public.hospitals'...")
-        gdf_hospitals = gpd.read_postgis(
-            sql=text(SQL_QUERY_HOSPITAL_DATA),
-            con=engine,
-            geom_col="geom",
-            crs="EPSG:4326",
+        cohort_columns(cohort)  # Reject bad expressions before looking at the columns
+        return cohort_weight_sql(cohort, get_population_columns(table_name))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid cohort: {e}")
+
+
+def population_source(data_input: AnalysisData):
+    """
+    Return (table, filter, params, weight) for the population rows 'p' an analysis reads.
+    'filter' is either empty or an " AND ..." condition on the year / country partitions,
+    'weight' is the SQL for the population of one point (TotalPopulation or the cohort).
+    """
+    if data_input.year is None:
+        if data_input.country is not None:
+            raise HTTPException(status_code=422, detail="A country filter needs a year.")
+        weight = population_weight_sql(data_input.cohort, POPULATION_TABLE_NAME)
+        return f'public."{POPULATION_TABLE_NAME}"', "", {}, weight
+    partition_filter = ' AND p."Year" = :year'
+    params = {"year": data_input.year}
+    if data_input.country is not None:
+        partition_filter += ' AND p."Country" = :country'
+        params["country"] = data_input.country
+    weight = population_weight_sql(data_input.cohort, POPULATION_TIME_SERIES_TABLE_NAME)
+    return f'public."{POPULATION_TIME_SERIES_TABLE_NAME}"', partition_filter, params, weight
+
+
+def center_params(data_input: AnalysisData):
+    if data_input.latitude is None or data_input.longitude is None:
+        raise HTTPException(
+            status_code=422,
+            detail="Provide latitude/longitude with radius_meters or ring_radii_meters, a polygon, or an admin_area_id.",
         )
-        print(
-            f"Successfully read {len(gdf_hospitals)} records from 'public.hospitals'."
+    return {"lon": data_input.longitude, "lat": data_input.latitude}
+
+
+def dwithin_sql(geom, center, radius):
+    """
+    SQL testing whether 'geom' (an indexed SRID-4326 geometry column) lies within 'radius' metres
+    of the point 'center'. The && test against the point's box, widened in longitude for its
+    latitude, lets PostgreSQL use the GIST index; ST_DWithin on geography then gives the exact answer.
+    """
+    degrees = f"({radius}) / {PREFILTER_METERS_PER_DEGREE}.0"
+    return (
+        f"{geom} && ST_Expand({center}, {degrees} / cos(radians(LEAST(abs(ST_Y({center})) + {degrees}, 89.0))), {degrees})"
+        f" AND ST_DWithin({geom}::geography, {center}::geography, {radius})"
+    )
+
+
+def build_area_rows(data_input: AnalysisData, table, row_filter=""):
+    """
+    Return (ctes, rows, params, kind): 'rows' is a "FROM ... WHERE ..." clause yielding the
+    population points 'p' of 'table' inside the requested circle, custom polygon or admin polygon
+    (each point once), restricted further by 'row_filter' (empty or " AND ...").
+    kind is "circle", "polygon" or "admin_area". Raises HTTPException(422) for incomplete input.
+    """
+    if data_input.polygon is not None:
+        # The drawn polygon is subdivided on the fly so each point is tested against a small piece;
+        # EXISTS makes sure points on the seams between pieces are only counted once.
+        ctes = f"""
+            WITH area AS (
+                SELECT ST_MakeValid(ST_SetSRID(ST_GeomFromGeoJSON(:polygon), 4326)) AS geom
+            ),
+            pieces AS (
+                SELECT ST_Subdivide(area.geom, {ANALYSIS_POLYGON_SUBDIVIDE_VERTICES}) AS geom FROM area
+            )
+        """
+        rows = f"""FROM {table} p
+            WHERE p.{POPULATION_GEOM_COL} && (SELECT geom FROM area)
+              AND EXISTS (SELECT 1 FROM pieces WHERE ST_Intersects(pieces.geom, p.{POPULATION_GEOM_COL})){row_filter}"""
+        return ctes, rows, {"polygon": json.dumps(data_input.polygon)}, "polygon"
+
+    if data_input.admin_area_id is not None:
+        # Admin polygons were subdivided at import time (see ImportVectorToDatabase.py).
+        # Every small piece finds its points through the population GIST index; DISTINCT ON
+        # the point keeps points lying on a seam between two pieces from being counted twice.
+        ctes = f"""
+            WITH area_points AS (
+                SELECT DISTINCT ON (p.tableoid, p.ctid) p.*
+                FROM public."{ANALYSIS_POLYGONS_SUBDIVIDED_TABLE_NAME}" a
+                JOIN {table} p
+                  ON ST_Intersects(a.{POLYGON_GEOMETRY_COLUMN_NAME}, p.{POPULATION_GEOM_COL})
+                WHERE a."{ANALYSIS_POLYGONS_ID_COLUMN_NAME}" = :admin_area_id{row_filter}
+            )
+        """
+        return ctes, "FROM area_points p", {"admin_area_id": data_input.admin_area_id}, "admin_area"
+
+    params = center_params(data_input)
+    if data_input.radius_meters is None:
+        raise HTTPException(
+            status_code=422,
+            detail="Provide radius_meters or ring_radii_meters for a point analysis.",
         )
-    except Exception as e:
-        error_message = (
-            f"An error occurred during database interaction for hospital data: {str(e)}"
+    condition = dwithin_sql(
+        f"p.{POPULATION_GEOM_COL}", "ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)", ":radius"
+    )
+    rows = f"FROM {table} p WHERE {condition}{row_filter}"
+    return "", rows, {**params, "radius": data_input.radius_meters}, "circle"
+
+
+def build_analysis_query(data_input: AnalysisData):
+    """
+    Build the SQL and parameters for an analysis request.
+    Returns (sql, params, kind) with kind one of "circle", "rings", "polygon", "admin_area".
+    Raises HTTPException(422) for incomplete or invalid input.
+    """
+    table, partition_filter, source_params, weight = population_source(data_input)
+
+    if (
+        data_input.polygon is None
+        and data_input.admin_area_id is None
+        and data_input.ring_radii_meters
+    ):
+        params = center_params(data_input)
+        radii = sorted(set(data_input.ring_radii_meters))
+        if radii[0] <= 0:
+            raise HTTPException(status_code=422, detail="Ring radii must be positive.")
+        # One scan: every point's distance is computed once and binned into its ring.
+        # width_bucket(d, [r1, r2, ...]) is 0 for d < r1, 1 for r1 <= d < r2, ...
+        # (a point exactly on the outermost edge is put in the last ring).
+        sql = f"""
+            SELECT LEAST(width_bucket(distance, CAST(:radii AS double precision[])), :last_ring) AS ring,
+                   SUM(population)
+            FROM (
+                SELECT ST_Distance(p.{POPULATION_GEOM_COL}::geography, center.geom::geography) AS distance,
+                       {weight} AS population
+                FROM {table} p,
+                     (SELECT ST_SetSRID(ST_MakePoint(:lon, :lat), 4326) AS geom) center
+                WHERE {dwithin_sql(f"p.{POPULATION_GEOM_COL}", "center.geom", ":max_radius")}{partition_filter}
+            ) distances
+            GROUP BY ring
+            ORDER BY ring;
+        """
+        params.update(
+            source_params,
+            radii=radii,
+            last_ring=len(radii) - 1,
+            max_radius=radii[-1],
         )
-        print(f"ERROR: {error_message}")
+        return sql, params, "rings"
+
+    ctes, rows, params, kind = build_area_rows(data_input, table, partition_filter)
+    sql = f"""
+        {ctes}
+        SELECT SUM({weight})
+        {rows};
+    """
+    return sql, {**params, **source_params}, kind
+
+
+def build_change_query(data_input: PopulationChangeData):
+    """
+    Build the SQL and parameters comparing the population of two years inside one area.
+    Both years are summed in a single scan over their two partitions (FILTER aggregates).
+    """
+    if data_input.ring_radii_meters or data_input.year is not None:
         raise HTTPException(
-            status_code=500,
-            detail=error_message,
+            status_code=422,
+            detail="Population change takes from_year/to_year and a circle, polygon or admin area (no rings, no year).",
         )
-    if gdf_hospitals is not None and not gdf_hospitals.empty:
-        print(f"Returning {len(gdf_hospitals)} hospital records as GeoJSON.")
-        print("--- Get Hospitals Endpoint: Success ---")
-        return gdf_hospitals.__geo_interface__
-    elif gdf_hospitals is not None and gdf_hospitals.empty:
-        message = "No hospital data found in table 'public.hospitals'."
-        print(f"INFO: {message}")
-        print("--- Get Hospitals Endpoint: Success (No Data) ---")
-        return {"type": "FeatureCollection", "features": []}
-    else:
-        message = f"Failed to read hospital data from 'public.hospitals', or an unexpected issue occurred."
-        print(f"ERROR: {message}")
+    if data_input.from_year == data_input.to_year:
+        raise HTTPException(status_code=422, detail="from_year and to_year must differ.")
+    year_filter = ' AND p."Year" IN (:from_year, :to_year)'
+    if data_input.country is not None:
+        year_filter += ' AND p."Country" = :country'
+    ctes, rows, params, kind = build_area_rows(
+        data_input, f'public."{POPULATION_TIME_SERIES_TABLE_NAME}"', year_filter
+    )
+    params.update(from_year=data_input.from_year, to_year=data_input.to_year)
+    if data_input.country is not None:
+        params["country"] = data_input.country
+    weight = population_weight_sql(data_input.cohort, POPULATION_TIME_SERIES_TABLE_NAME)
+    sql = f"""
+        {ctes}
+        SELECT SUM({weight}) FILTER (WHERE p."Year" = :from_year),
+               SUM({weight}) FILTER (WHERE p."Year" = :to_year)
+        {rows};
+    """
+    return sql, params, kind
+
+
+def run_analysis(connection, data_input: AnalysisData):
+    """
+    Run an analysis request on an open connection and return the response dictionary.
+    """
+    sql, params, kind = build_analysis_query(data_input)
+    result = connection.execute(text(sql), params)
+
+    if kind == "rings":
+        radii = params["radii"]
+        ring_sums = {ring: population for ring, population in result.all()}
+        rings = []
+        inner = 0
+        for ring_number, outer in enumerate(radii):
+            rings.append(
+                {
+                    "inner_meters": inner,
+                    "outer_meters": outer,
+                    "population_count": int(ring_sums.get(ring_number) or 0),
+                }
+            )
+            inner = outer
+        total = sum(ring["population_count"] for ring in rings)
+        print(f"Analysis complete. Total Population in {len(rings)} rings: {total}")
+        return {"population_count": total, "rings": rings}
+
+    population_sum = result.scalar_one()
+    if population_sum is None:
+        population_sum = 0
+    print(f"Analysis complete. Total Population in {kind}: {population_sum}")
+    return {"population_count": int(population_sum)}
+
+
+def set_statement_timeout(connection, seconds):
+    """
+    Limit every statement of the current transaction on 'connection' to 'seconds'.
+    """
+    connection.execute(
+        text("SELECT set_config('statement_timeout', :timeout, true);"),
+        {"timeout": f"{int(seconds * 1000)}ms"},
+    )
+
+
+def check_analysis_size(data_input: AnalysisData):
+    """
+    Refuse point analyses whose area is too large to answer while the client waits
+    (the index box read for a circle grows with the square of its radius).
+    """
+    radii = list(data_input.ring_radii_meters or [])
+    if data_input.radius_meters is not None:
+        radii.append(data_input.radius_meters)
+    if any(radius <= 0 for radius in radii):
+        raise HTTPException(status_code=422, detail="Radii must be positive.")
+    if radii and max(radii) > MAX_ANALYSIS_RADIUS_METERS:
         raise HTTPException(
-            status_code=500,
-            detail=message,
+            status_code=422,
+            detail=f"Radii above {MAX_ANALYSIS_RADIUS_METERS} m are too large for a direct analysis, submit them to /jobs/analysis instead.",
         )
 
 
-@app.post("/api/analysis_data")
-async def analysis_data(data_input: AnalysisData):
-    print("Start to analysis buffer circle data")
-    engine = None
-    gdf_populations = None
-    SQL_QUERY_ANALYSIS_DATA = f'SELECT SUM("TotalPopulation") FROM "{POPULATION_TABLE_NAME}" WHERE ST_DWithin(geometry::geography,ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography,:radius);'
-    params = {
-        "lon": data_input.longitude,
-        "lat": data_input.latitude,
-        "radius": data_input.radius_meters,
+async def run_cancellable(request: Request, connection, function, *args):
+    """
+    Run function(*args) (blocking database work on 'connection') in a worker thread, so the
+    event loop keeps serving other requests. If the client disconnects meanwhile, the running
+    statement is cancelled on the server instead of being left to finish for nobody.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            print("INFO: Client disconnected, cancelling the running query.")
+            connection.connection.dbapi_connection.cancel()
+            try:
+                await task
+            except Exception:
+                pass  # The cancelled statement raises inside the thread
+            raise HTTPException(status_code=499, detail="Client closed the request.")
+
+
+def run_population_change(connection, data_input: PopulationChangeData):
+    """
+    Run a population change request on an open connection and return the response dictionary.
+    """
+    sql, params, kind = build_change_query(data_input)
+    from_population, to_population = connection.execute(text(sql), params).one()
+    from_population = int(from_population or 0)
+    to_population = int(to_population or 0)
+    change = to_population - from_population
+    print(
+        f"Change analysis complete. Population in {kind}: {from_population} ({data_input.from_year}) -> {to_population} ({data_input.to_year})"
+    )
+    return {
+        "from_year": data_input.from_year,
+        "to_year": data_input.to_year,
+        "from_population": from_population,
+        "to_population": to_population,
+        "change": change,
+        "change_percent": round(100 * change / from_population, 2) if from_population else None,
     }
-    try:
-        engine = create_engine(DATABASE_CONNECTION_STRING)
-        with engine.connect() as connection:
-            result = connection.execute(text(SQL_QUERY_ANALYSIS_DATA), params)
-            population_sum = result.scalar_one()
-            if population_sum is None:
-                population_sum = 0
-            print(f"Analysis complete. Total Population in buffer: {population_sum}")
 
-            return {"population_count": int(population_sum)}
 
+def run_with_timeout(connection, function, data_input, timeout_seconds):
+    set_statement_timeout(connection, timeout_seconds)
+    return function(connection, data_input)
+
+
+async def run_limited_analysis(request: Request, function, data_input):
+    """
+    Run function(connection, data_input) under the analysis concurrency limit and statement
+    timeout, cancelling it if the client disconnects; maps refusals and timeouts to HTTP errors.
+    """
+    try:
+        async with analysis_limiter.slot():
+            with get_engine().connect() as connection:
+                return await run_cancellable(
+                    request,
+                    connection,
+                    run_with_timeout,
+                    connection,
+                    function,
+                    data_input,
+                    ANALYSIS_STATEMENT_TIMEOUT_SECONDS,
+                )
+
+    except HTTPException:
+        raise
+    except WaitQueueFullError as e:
+        print(f"INFO: Analysis refused: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    except WaitTimeoutError as e:
+        print(f"INFO: Analysis refused: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
     except Exception as e:
+        if isinstance(e, DBAPIError) and getattr(e.orig, "pgcode", None) == PG_QUERY_CANCELED:
+            error_message = f"The analysis took longer than {ANALYSIS_STATEMENT_TIMEOUT_SECONDS}s and was stopped, submit it to /jobs/analysis instead."
+            print(f"INFO: {error_message}")
+            raise HTTPException(status_code=504, detail=error_message)
         error_message = (
             f"An error occurred during database interaction for data analysis: {str(e)}"
         )
@@ -350,3 +1092,346 @@ async def analysis_data(data_input: AnalysisData):
             status_code=500,
             detail=error_message,
         )
+
+
+@app.post("/api/analysis_data")
+async def analysis_data(data_input: AnalysisData, request: Request):
+    """
+    API endpoint summing population inside a circle, a set of concentric rings,
+    a custom GeoJSON polygon or an admin polygon (of one year, if 'year' is given).
+    Limited to ANALYSIS_MAX_CONCURRENT at a time and ANALYSIS_STATEMENT_TIMEOUT_SECONDS each.
+    """
+    print("Start to analysis data")
+    check_analysis_size(data_input)
+    build_analysis_query(data_input)  # Reject invalid input before waiting for a slot
+    return await run_limited_analysis(request, run_analysis, data_input)
+
+
+@app.post("/api/population_change")
+async def population_change(data_input: PopulationChangeData, request: Request):
+    """
+    API endpoint comparing the population of from_year and to_year inside a circle,
+    a custom GeoJSON polygon or an admin polygon.
+    """
+    print("Start to analysis population change")
+    check_analysis_size(data_input)
+    build_change_query(data_input)  # Reject invalid input before waiting for a slot
+    return await run_limited_analysis(request, run_population_change, data_input)
+
+
+def get_tile_archive():
+    """
+    Return the opened MBTiles archive, opening it on first use.
+    """
+    global tile_archive
+    if tile_archive is None:
+        if not os.path.exists(TILE_ARCHIVE_PATH):
+            message = f"Tile archive '{TILE_ARCHIVE_PATH}' not found. Run ExportTiles.py first."
+            print(f"ERROR: {message}")
+            raise HTTPException(status_code=404, detail=message)
+        tile_archive = MBTilesArchive(TILE_ARCHIVE_PATH)
+        print(f"Opened tile archive '{TILE_ARCHIVE_PATH}'.")
+    return tile_archive
+
+
+@app.get("/tiles/metadata")
+async def get_tile_metadata():
+    """
+    API endpoint returning the metadata (bounds, zoom range, layers) of the tile archive.
+    """
+    return get_tile_archive().get_metadata()
+
+
+@app.get("/tiles/{z}/{x}/{y}.pbf")
+async def get_tile(z: int, x: int, y: int):
+    """
+    API endpoint serving a pre-rendered vector tile straight from the MBTiles archive.
+    No database work is done; empty tiles were skipped at export time and return 204.
+    Invalid coordinates return 422, zoom levels the archive wasn't rendered for 404.
+    """
+    archive = get_tile_archive()
+    if z < 0:
+        raise HTTPException(status_code=422, detail=f"Invalid zoom {z}: must be >= 0.")
+    # Checked before x/y, so a huge z never gets as far as 2**z
+    if not archive.min_zoom <= z <= archive.max_zoom:
+        raise HTTPException(
+            status_code=404,
+            detail=f"The tile archive covers zoom {archive.min_zoom}-{archive.max_zoom} only.",
+        )
+    if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(
+            status_code=422, detail=f"Invalid tile {z}/{x}/{y}: need 0 <= x, y < 2**z."
+        )
+    tile_data = archive.get_tile(z, x, y)
+    if tile_data is None:
+        return Response(status_code=204)
+    return Response(
+        content=tile_data,
+        media_type="application/x-protobuf",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+def get_hospital_index():
+    """
+    Return the hospital index, rebuilding it when a new shared snapshot has been published.
+    The STRtree itself can't be shared between processes, but its coordinate arrays are the
+    memory-mapped ones; the new index replaces the old one in a single assignment.
+    """
+    global hospital_index, hospital_index_snapshot
+    snapshot = get_layer_snapshot()
+    if snapshot.name != hospital_index_snapshot:
+        hospital_index = HospitalIndex.from_arrays(
+            snapshot.arrays, snapshot.extras["hospital_names"]
+        )
+        hospital_index_snapshot = snapshot.name
+        print(f"Hospital index rebuilt with {len(hospital_index)} hospitals.")
+    return hospital_index
+
+
+async def get_hospital_index_async():
+    """
+    get_hospital_index for the event loop: returns the current index at once, and builds a
+    new one (after a publish, or on first use) in a worker thread.
+    """
+    snapshot = shared_layers.load()
+    if snapshot is not None and snapshot.name == hospital_index_snapshot:
+        return hospital_index
+    return await asyncio.to_thread(get_hospital_index)
+
+
+def check_nearest_k(k: int):
+    if not 1 <= k <= MAX_NEAREST_HOSPITALS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"k must be between 1 and {MAX_NEAREST_HOSPITALS}.",
+        )
+
+
+@app.get("/api/nearest_hospitals")
+async def nearest_hospitals(latitude: float, longitude: float, k: int = 5):
+    """
+    API endpoint returning the k hospitals nearest to a point, with great-circle distances in metres.
+    Answered from the in-memory STRtree, no database round trip.
+    """
+    check_nearest_k(k)
+    index = await get_hospital_index_async()
+    indices, distances = (
+        await asyncio.to_thread(index.nearest, [longitude], [latitude], k)
+    )[0]
+    return {"hospitals": index.describe(indices, distances)}
+
+
+@app.post("/api/nearest_hospitals/batch")
+async def nearest_hospitals_batch(batch_input: NearestHospitalsBatch):
+    """
+    API endpoint answering nearest-hospital queries for many points at once (vectorized STRtree
+    queries, run in a worker thread so a large batch doesn't block the event loop).
+    At most MAX_NEAREST_BATCH_POINTS points per request.
+    """
+    check_nearest_k(batch_input.k)
+    index = await get_hospital_index_async()
+    longitudes = [point.longitude for point in batch_input.points]
+    latitudes = [point.latitude for point in batch_input.points]
+    results = await asyncio.to_thread(index.nearest, longitudes, latitudes, batch_input.k)
+    return {
+        "results": [
+            index.describe(indices, distances) for indices, distances in results
+        ]
+    }
+
+
+# --- Background Jobs ---
+
+
+def job_hospital_coverage(params, report_progress):
+    """
+    Job: population within radius_meters of every hospital, plus the total covered population
+    (points near several hospitals are counted once in the total).
+    """
+    weight = population_weight_sql(params.get("cohort"), POPULATION_TABLE_NAME)
+    with get_engine().connect() as connection:
+        set_statement_timeout(connection, JOB_STATEMENT_TIMEOUT_SECONDS)
+        hospital_ids = (
+            connection.execute(text('SELECT id FROM public."hospitals" ORDER BY id;'))
+            .scalars()
+            .all()
+        )
+        sql_per_hospital = text(
+            f"""
+            SELECT h.id, COALESCE(SUM({weight}), 0)
+            FROM public."hospitals" h
+            LEFT JOIN public."{POPULATION_TABLE_NAME}" p
+              ON {dwithin_sql(f"p.{POPULATION_GEOM_COL}", "h.geom", ":radius")}
+            WHERE h.id = ANY(:ids)
+            GROUP BY h.id;
+            """
+        )
+        per_hospital = {}
+        for start in range(0, len(hospital_ids), JOB_BATCH_SIZE):
+            ids = hospital_ids[start : start + JOB_BATCH_SIZE]
+            for hospital_id, population in connection.execute(
+                sql_per_hospital, {"ids": ids, "radius": params["radius_meters"]}
+            ):
+                per_hospital[hospital_id] = int(population)
+            # The last 10% is kept for the total coverage query below
+            report_progress(
+                0.9 * (start + len(ids)) / len(hospital_ids),
+                f"{start + len(ids)} of {len(hospital_ids)} hospitals done.",
+            )
+
+        report_progress(0.9, "Computing total covered population...")
+        total_covered = connection.execute(
+            text(
+                f"""
+                SELECT COALESCE(SUM(population), 0) FROM (
+                    SELECT DISTINCT ON (p.tableoid, p.ctid) {weight} AS population
+                    FROM public."hospitals" h
+                    JOIN public."{POPULATION_TABLE_NAME}" p
+                      ON {dwithin_sql(f"p.{POPULATION_GEOM_COL}", "h.geom", ":radius")}
+                ) covered;
+                """
+            ),
+            {"radius": params["radius_meters"]},
+        ).scalar_one()
+    return {
+        "radius_meters": params["radius_meters"],
+        "cohort": params.get("cohort"),
+        "total_covered_population": int(total_covered),
+        "hospitals": [
+            {"hospital_id": hospital_id, "population_count": population}
+            for hospital_id, population in per_hospital.items()
+        ],
+    }
+
+
+def job_admin_population(params, report_progress):
+    """
+    Job: population of every admin polygon, using the subdivided copy of the polygons.
+    """
+    weight = population_weight_sql(params.get("cohort"), POPULATION_TABLE_NAME)
+    with get_engine().connect() as connection:
+        set_statement_timeout(connection, JOB_STATEMENT_TIMEOUT_SECONDS)
+        area_ids = (
+            connection.execute(
+                text(
+                    f'SELECT "{ANALYSIS_POLYGONS_ID_COLUMN_NAME}" FROM public."{ANALYSIS_POLYGONS_TABLE_NAME}" '
+                    f'ORDER BY "{ANALYSIS_POLYGONS_ID_COLUMN_NAME}";'
+                )
+            )
+            .scalars()
+            .all()
+        )
+        # DISTINCT ON the point keeps points lying on a seam between two pieces from being counted twice
+        sql_per_area = text(
+            f"""
+            SELECT gid, SUM(population) FROM (
+                SELECT DISTINCT ON (a."{ANALYSIS_POLYGONS_ID_COLUMN_NAME}", p.tableoid, p.ctid)
+                       a."{ANALYSIS_POLYGONS_ID_COLUMN_NAME}" AS gid, {weight} AS population
+                FROM public."{ANALYSIS_POLYGONS_SUBDIVIDED_TABLE_NAME}" a
+                JOIN public."{POPULATION_TABLE_NAME}" p
+                  ON ST_Intersects(a.{POLYGON_GEOMETRY_COLUMN_NAME}, p.{POPULATION_GEOM_COL})
+                WHERE a."{ANALYSIS_POLYGONS_ID_COLUMN_NAME}" = ANY(:ids)
+            ) points
+            GROUP BY gid;
+            """
+        )
+        per_area = {area_id: 0 for area_id in area_ids}
+        for start in range(0, len(area_ids), JOB_BATCH_SIZE):
+            ids = area_ids[start : start + JOB_BATCH_SIZE]
+            for area_id, population in connection.execute(sql_per_area, {"ids": ids}):
+                per_area[area_id] = int(population or 0)
+            report_progress(
+                (start + len(ids)) / len(area_ids),
+                f"{start + len(ids)} of {len(area_ids)} admin areas done.",
+            )
+    return {
+        "cohort": params.get("cohort"),
+        "admin_areas": [
+            {"admin_area_id": area_id, "population_count": population}
+            for area_id, population in per_area.items()
+        ]
+    }
+
+
+def job_analysis(params, report_progress):
+    """
+    Job: any /api/analysis_data request, run in the background.
+    """
+    with get_engine().connect() as connection:
+        set_statement_timeout(connection, JOB_STATEMENT_TIMEOUT_SECONDS)
+        return run_analysis(connection, AnalysisData(**params))
+
+
+async def submit_job(kind, function, params):
+    """
+    Queue a job and return the 202 response body, or 503 if the queue is full.
+    """
+    try:
+        job = await asyncio.to_thread(job_queue.submit, get_engine(), kind, function, params)
+    except QueueFullError as e:
+        print(f"INFO: Job '{kind}' refused: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result",
+    }
+
+
+@app.post("/jobs/hospital_coverage", status_code=202)
+async def submit_hospital_coverage_job(job_input: CoverageJob):
+    """
+    Start a background job computing the population covered by every hospital.
+    """
+    if job_input.radius_meters <= 0:
+        raise HTTPException(status_code=422, detail="radius_meters must be positive.")
+    population_weight_sql(job_input.cohort, POPULATION_TABLE_NAME)  # Validate the cohort now
+    return await submit_job("hospital_coverage", job_hospital_coverage, job_input.model_dump())
+
+
+@app.post("/jobs/admin_population", status_code=202)
+async def submit_admin_population_job(cohort: str | None = None):
+    """
+    Start a background job computing the population (or the 'cohort') of every admin polygon.
+    """
+    population_weight_sql(cohort, POPULATION_TABLE_NAME)  # Validate the cohort now
+    return await submit_job("admin_population", job_admin_population, {"cohort": cohort})
+
+
+@app.post("/jobs/analysis", status_code=202)
+async def submit_analysis_job(data_input: AnalysisData):
+    """
+    Start a background job for an analysis too big to wait for (same input as /api/analysis_data).
+    """
+    build_analysis_query(data_input)  # Validate the input now instead of failing inside the job
+    return await submit_job("analysis", job_analysis, data_input.model_dump())
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Status and progress of a background job.
+    """
+    job = await asyncio.to_thread(job_queue.get, get_engine(), job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired.")
+    return job.status()
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Result of a finished background job.
+    """
+    job = await asyncio.to_thread(job_queue.get, get_engine(), job_id, True)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired.")
+    if job.state == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+    if job.state != JOB_SUCCEEDED:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job is {job.state} ({job.progress:.0%}), no result yet.",
+        )
+    return {"job_id": job.id, "kind": job.kind, "result": job.result}
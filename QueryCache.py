@@ -0,0 +1,299 @@
+# Import necessary libraries
+import hashlib  # For cache keys
+import json  # For serializing query parameters into the key
+import os  # For cache files, sizes and access times
+import re  # For normalizing SQL text
+import time  # For timing reads
+import uuid  # For unique temporary file names
+import geopandas as gpd  # For reading/writing GeoParquet
+import pandas as pd  # For non-spatial results
+from sqlalchemy import text  # For executing plain SQL
+from ReadFromPostGIS import read_geodataframe  # Chunked binary table reads
+
+# --- Query Cache Configuration ---
+# Analysts run the same reads over and over, and every run transfers the whole result from the
+# server again. This cache stores results as GeoParquet files on local disk, keyed by the
+# normalized SQL, its parameters and a version marker of every table the query reads.
+# When a table changes (re-import, new rows, CLUSTER, ...) its marker changes and the old
+# entries are simply never hit again; they age out through the LRU size cap.
+DEFAULT_CACHE_DIR = ".query_cache"
+DEFAULT_MAX_CACHE_BYTES = 5 * 1024**3  # 5 GB
+CACHE_FILE_EXTENSION = ".parquet"
+
+# Version markers:
+# "counter":  physical file id of the table (and its partitions) + version numbers in
+#             public.relation_versions, raised by a statement-level trigger on every write.
+#             Transactional and never goes backwards, so a marker never comes back to match an
+#             old entry. Default. The triggers are installed by install_version_triggers (the
+#             importers and the API's warm-up do this), never by a read: a table without them
+#             falls back to "checksum".
+# "stats":    physical file id + insert/update/delete counters of the table from the statistics
+#             views. Needs no trigger, but the counters are updated asynchronously and are lost
+#             on a crash or pg_stat_reset(), so a marker can repeat and hit a stale entry. Opt-in.
+# "checksum": row count + newest transaction id (xmin) of the rows. Exact, but scans the table.
+VERSION_MODES = ["counter", "stats", "checksum"]
+DEFAULT_VERSION_MODE = "counter"
+VERSION_TABLE_NAME = "relation_versions"
+VERSION_TRIGGER_NAME = "bump_relation_version"
+
+SQL_CREATE_VERSION_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS public."{VERSION_TABLE_NAME}" (
+        relid oid PRIMARY KEY,
+        version bigint NOT NULL
+    );
+"""
+# A write raises the version of the written table and of every table it is a partition of,
+# so a partition read directly and its parent both see writes made through either of them
+SQL_CREATE_VERSION_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION public.{VERSION_TRIGGER_NAME}() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO public."{VERSION_TABLE_NAME}" AS v (relid, version)
+        SELECT TG_RELID, 1
+        UNION
+        SELECT relid, 1 FROM pg_partition_ancestors(TG_RELID)
+        ON CONFLICT (relid) DO UPDATE SET version = v.version + 1;
+        RETURN NULL;
+    END;
+    $$;
+"""
+# Tables of the partition tree without the version trigger
+SQL_UNVERSIONED_RELATIONS = f"""
+    SELECT t.relid::regclass::text
+    FROM pg_partition_tree(CAST(:table AS regclass)) t
+    WHERE NOT EXISTS (
+        SELECT 1 FROM pg_trigger g
+        WHERE g.tgrelid = t.relid AND g.tgname = '{VERSION_TRIGGER_NAME}'
+    );
+"""
+# The versions of the table and its ancestors change with every write to the table, one of its
+# partitions (through the trigger's ancestors) or one of its ancestors (routed to it)
+SQL_TABLE_VERSION_COUNTER = f"""
+    SELECT (
+        SELECT string_agg(c.relfilenode::text, ',' ORDER BY c.oid)
+        FROM pg_partition_tree(CAST(:table AS regclass)) t
+        JOIN pg_class c ON c.oid = t.relid
+    ) || ':' || (
+        SELECT string_agg(COALESCE(v.version, 0)::text, ',' ORDER BY r.relid)
+        FROM (
+            SELECT CAST(:table AS regclass)::oid AS relid
+            UNION
+            SELECT relid FROM pg_partition_ancestors(CAST(:table AS regclass))
+        ) r
+        LEFT JOIN public."{VERSION_TABLE_NAME}" v ON v.relid = r.relid
+    );
+"""
+
+SQL_TABLE_VERSION_STATS = """
+    SELECT string_agg(
+               c.relfilenode::text || ':' ||
+               COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0)::text,
+               ',' ORDER BY c.oid)
+    FROM pg_partition_tree(CAST(:table AS regclass)) t
+    JOIN pg_class c ON c.oid = t.relid
+    LEFT JOIN pg_stat_user_tables s ON s.relid = t.relid;
+"""
+
+
+# Tables already reported as lacking the version trigger, so the warning is printed once
+unversioned_tables = set()
+
+
+def install_version_triggers(connection, table_name, schema="public"):
+    """
+    Add the version trigger to every table of a partition tree that lacks it (run it again
+    after adding partitions). DDL: needs the table's owner, and runs in the caller's
+    transaction; concurrent installs are serialized by an advisory lock.
+    Returns the number of triggers created.
+    """
+    qualified_name = f'{schema}."{table_name}"'
+    connection.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:name));"), {"name": VERSION_TRIGGER_NAME}
+    )
+    connection.execute(text(SQL_CREATE_VERSION_TABLE))
+    connection.execute(text(SQL_CREATE_VERSION_FUNCTION))
+    relations = (
+        connection.execute(text(SQL_UNVERSIONED_RELATIONS), {"table": qualified_name})
+        .scalars()
+        .all()
+    )
+    for relation in relations:
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {VERSION_TRIGGER_NAME} "
+                f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {relation} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION public.{VERSION_TRIGGER_NAME}();"
+            )
+        )
+        print(f"Query cache: version trigger added to {relation}.")
+    unversioned_tables.discard(qualified_name)
+    return len(relations)
+
+
+def has_version_triggers(connection, qualified_name):
+    """True if the version table exists and every table of the partition tree has the trigger."""
+    if connection.execute(
+        text("SELECT to_regclass(:name);"), {"name": f'public."{VERSION_TABLE_NAME}"'}
+    ).scalar() is None:
+        return False
+    return not connection.execute(
+        text(SQL_UNVERSIONED_RELATIONS), {"table": qualified_name}
+    ).first()
+
+
+def table_version(connection, table_name, schema="public", version_mode=DEFAULT_VERSION_MODE):
+    """
+    Return the version marker of one table as a string (see VERSION_MODES).
+    Only reads: in "counter" mode a table without the version triggers gets a "checksum" marker.
+    """
+    qualified_name = f'{schema}."{table_name}"'
+    if version_mode == "counter":
+        if has_version_triggers(connection, qualified_name):
+            return "counter:" + connection.execute(
+                text(SQL_TABLE_VERSION_COUNTER), {"table": qualified_name}
+            ).scalar_one()
+        if qualified_name not in unversioned_tables:
+            unversioned_tables.add(qualified_name)
+            print(
+                f"Query cache: {qualified_name} has no version trigger (see install_version_triggers), "
+                "using a checksum."
+            )
+        version_mode = "checksum"
+    if version_mode == "stats":
+        return connection.execute(
+            text(SQL_TABLE_VERSION_STATS), {"table": qualified_name}
+        ).scalar_one()
+    row = connection.execute(
+        text(f"SELECT COUNT(*), MAX(xmin::text::bigint) FROM {qualified_name};")
+    ).one()
+    return f"{row[0]}:{row[1]}"
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and drop a trailing ';' so formatting doesn't change the key."""
+    return re.sub(r"\s+", " ", str(sql)).strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """
+    Disk cache of query results as GeoParquet, with version-aware keys and LRU eviction.
+    The file modification time is used as the LRU timestamp (it is bumped on every hit).
+    """
+
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        max_bytes=DEFAULT_MAX_CACHE_BYTES,
+        version_mode=DEFAULT_VERSION_MODE,
+    ):
+        if version_mode not in VERSION_MODES:
+            raise ValueError(f"version_mode must be one of {VERSION_MODES}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version_mode = version_mode
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # --- Keys and versions ---
+    def table_version(self, connection, table_name, schema="public"):
+        """Return the version marker of one table as a string."""
+        return table_version(connection, table_name, schema, self.version_mode)
+
+    def make_key(self, engine, sql, params, tables):
+        """Cache key from the normalized SQL, its parameters and the versions of 'tables'."""
+        with engine.connect() as connection:
+            versions = {table: self.table_version(connection, table) for table in tables}
+        key_source = json.dumps(
+            {
+                "sql": normalize_sql(sql),
+                "params": params or {},
+                "versions": versions,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXTENSION)
+
+    # --- Cache hits / stores ---
+    def load(self, key):
+        """Return the cached result for 'key' (memory-mapped Parquet read), or None."""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # Mark as recently used
+        try:
+            return gpd.read_parquet(path, memory_map=True)
+        except ValueError:
+            # No geometry metadata: the result was a plain (non-spatial) DataFrame
+            return pd.read_parquet(path, memory_map=True)
+
+    def store(self, key, frame):
+        """Write a result to the cache (atomically) and evict old entries if over the size cap."""
+        temp_path = os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.tmp")
+        frame.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self.path_for(key))
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_FILE_EXTENSION):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total_bytes -= size
+            print(f"Query cache: evicted '{name}'.")
+
+    # --- Cached reads ---
+    def read_postgis(
+        self, engine, sql, tables, params=None, geom_col="geom", crs="EPSG:4326"
+    ):
+        """
+        Cached gpd.read_postgis. 'tables' lists every table the query reads, so a change
+        in any of them invalidates the entry.
+        """
+        start = time.perf_counter()
+        key = self.make_key(engine, sql, params, tables)
+        cached = self.load(key)
+        if cached is not None:
+            print(
+                f"Query cache hit: {len(cached)} rows in {time.perf_counter() - start:.2f}s."
+            )
+            return cached
+        result = gpd.read_postgis(
+            sql=text(str(sql)), con=engine, params=params, geom_col=geom_col, crs=crs
+        )
+        self.store(key, result)
+        print(
+            f"Query cache miss: {len(result)} rows read from the database in {time.perf_counter() - start:.2f}s."
+        )
+        return result
+
+    def read_table(self, engine, table_name, **read_options):
+        """Cached ReadFromPostGIS.read_geodataframe (same options: columns, bbox, where, ...)."""
+        start = time.perf_counter()
+        key = self.make_key(
+            engine,
+            f"read_table {table_name}",
+            read_options,
+            [table_name],
+        )
+        cached = self.load(key)
+        if cached is not None:
+            print(
+                f"Query cache hit: {len(cached)} rows in {time.perf_counter() - start:.2f}s."
+            )
+            return cached
+        result = read_geodataframe(engine, table_name, **read_options)
+        self.store(key, result)
+        print(
+            f"Query cache miss: {len(result)} rows read from the database in {time.perf_counter() - start:.2f}s."
+        )
+        return result
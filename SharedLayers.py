@@ -0,0 +1,146 @@
+# Import necessary libraries
+import json  # For the snapshot metadata
+import os  # For snapshot folders, the CURRENT pointer and atomic renames
+import shutil  # For removing old snapshots
+import time  # For sortable snapshot names
+import uuid  # For unique temporary names
+import numpy as np  # Arrays are stored as .npy files and memory-mapped
+
+# --- Shared Layers Configuration ---
+# With several uvicorn workers every process used to keep its own copy of the reference
+# layers. Instead, one worker writes them once as a snapshot folder on local disk:
+#   <name>.json  serialized responses (served straight from the file)
+#   <name>.npy   NumPy arrays (opened with mmap_mode="r")
+#   meta.json    table versions the snapshot was built from, plus small extras
+# Every worker maps the same files, so the data sits once in the OS page cache.
+# A snapshot is never changed after it is written: a new version is written to a new folder
+# and the CURRENT file is switched to it with an atomic rename. Workers notice the switch
+# on their next access and map the new folder; old folders are removed a few versions later.
+DEFAULT_LAYERS_DIR = ".shared_layers"
+CURRENT_FILE_NAME = "CURRENT"
+METADATA_FILE_NAME = "meta.json"
+KEEP_SNAPSHOTS = 3  # Folders kept, so a worker still reading an old one isn't cut off
+
+
+class LayerSnapshot:
+    """One published snapshot: memory-mapped arrays, file paths of the responses and metadata."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, METADATA_FILE_NAME)) as metadata_file:
+            metadata = json.load(metadata_file)
+        self.versions = metadata["versions"]
+        self.extras = metadata["extras"]
+        self.arrays = {
+            array_name: np.load(
+                os.path.join(path, array_name + ".npy"), mmap_mode="r"
+            )
+            for array_name in metadata["arrays"]
+        }
+        self.files = metadata["files"]
+
+    def file_path(self, name):
+        """Path of a serialized response stored in this snapshot."""
+        if name not in self.files:
+            raise KeyError(f"Snapshot '{self.name}' has no file '{name}'.")
+        return os.path.join(self.path, name + ".json")
+
+
+class SharedLayers:
+    """
+    Folder of immutable, versioned layer snapshots shared by all worker processes.
+    Concurrent publishes are harmless: each writes a complete folder and the last rename wins.
+    """
+
+    def __init__(self, layers_dir=DEFAULT_LAYERS_DIR):
+        self.layers_dir = layers_dir
+        self.snapshot = None
+        self.current_stamp = None
+        os.makedirs(layers_dir, exist_ok=True)
+
+    def current_name(self):
+        """Name of the snapshot CURRENT points to, or None if nothing was published yet."""
+        try:
+            with open(os.path.join(self.layers_dir, CURRENT_FILE_NAME)) as current_file:
+                return current_file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """
+        Return the current snapshot, mapping a new one if CURRENT has changed since the last call.
+        Costs one stat() when nothing changed. Returns None if nothing was published yet.
+        """
+        try:
+            stat = os.stat(os.path.join(self.layers_dir, CURRENT_FILE_NAME))
+        except FileNotFoundError:
+            return None
+        # CURRENT is replaced, never rewritten, so a new inode means a new snapshot
+        current_stamp = (stat.st_ino, stat.st_mtime_ns)
+        if current_stamp == self.current_stamp and self.snapshot is not None:
+            return self.snapshot
+        name = self.current_name()
+        if name is not None and (self.snapshot is None or self.snapshot.name != name):
+            self.snapshot = LayerSnapshot(os.path.join(self.layers_dir, name))
+            print(f"Shared layers: mapped snapshot '{name}'.")
+        self.current_stamp = current_stamp
+        return self.snapshot
+
+    def publish(self, versions, files=None, arrays=None, extras=None, reused_files=None):
+        """
+        Write a new snapshot and make it current.
+        'files' maps names to serialized bytes, 'arrays' maps names to NumPy arrays
+        (numeric dtypes only, so they can be memory-mapped), 'versions' and 'extras' must be JSON-ready.
+        'reused_files' maps names to files of an older snapshot that are taken over unchanged
+        (hard-linked where possible, so an unchanged layer isn't serialized or written again).
+        """
+        files = files or {}
+        arrays = arrays or {}
+        reused_files = reused_files or {}
+        name = f"snapshot_{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+        temp_path = os.path.join(self.layers_dir, f".{name}.tmp")
+        os.makedirs(temp_path)
+        for file_name, content in files.items():
+            with open(os.path.join(temp_path, file_name + ".json"), "wb") as output_file:
+                output_file.write(content)
+        for file_name, source_path in reused_files.items():
+            target_path = os.path.join(temp_path, file_name + ".json")
+            try:
+                os.link(source_path, target_path)  # Snapshots are never changed, so sharing is safe
+            except OSError:
+                shutil.copyfile(source_path, target_path)
+        for array_name, values in arrays.items():
+            np.save(os.path.join(temp_path, array_name + ".npy"), np.asarray(values))
+        with open(os.path.join(temp_path, METADATA_FILE_NAME), "w") as metadata_file:
+            json.dump(
+                {
+                    "versions": versions,
+                    "extras": extras or {},
+                    "arrays": list(arrays),
+                    "files": list(files) + list(reused_files),
+                },
+                metadata_file,
+            )
+        os.replace(temp_path, os.path.join(self.layers_dir, name))
+
+        # Switch CURRENT with an atomic rename, so readers see either the old or the new name
+        temp_current = os.path.join(self.layers_dir, f".{CURRENT_FILE_NAME}.{uuid.uuid4().hex}.tmp")
+        with open(temp_current, "w") as current_file:
+            current_file.write(name)
+        os.replace(temp_current, os.path.join(self.layers_dir, CURRENT_FILE_NAME))
+        print(f"Shared layers: published snapshot '{name}'.")
+        self.prune()
+        return name
+
+    def prune(self):
+        """Remove all but the newest KEEP_SNAPSHOTS snapshot folders."""
+        current = self.current_name()
+        snapshots = sorted(
+            name for name in os.listdir(self.layers_dir) if name.startswith("snapshot_")
+        )
+        for name in snapshots[:-KEEP_SNAPSHOTS]:
+            if name == current:
+                continue
+            # Mapped files can't be deleted on Windows; they are retried on the next publish
+            shutil.rmtree(os.path.join(self.layers_dir, name), ignore_errors=True)
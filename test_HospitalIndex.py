@@ -0,0 +1,33 @@
+from HospitalIndex import HospitalIndex, haversine_meters
+
+
+def test_nearest_returns_true_nearest_near_search_radius_edge():
+    # B is slightly closer than A but just outside the first search radius (0.05 degrees);
+    # the coverage bound must not accept A before B has been searched.
+    lon, lat = 31.0, 30.0
+    index = HospitalIndex(
+        ids=[1, 2],
+        names=["A", "B"],
+        doctor_counts=[1, 1],
+        longitudes=[lon + 0.0499, lon + 0.05001],
+        latitudes=[lat + 0.0029, lat],
+    )
+    distance_a = haversine_meters(lon, lat, lon + 0.0499, lat + 0.0029)
+    distance_b = haversine_meters(lon, lat, lon + 0.05001, lat)
+    assert distance_b < distance_a
+
+    [(indices, distances)] = index.nearest([lon], [lat], k=1)
+    assert index.ids[indices[0]] == 2
+    assert distances[0] == distance_b
+
+
+def test_nearest_batch_matches_brute_force():
+    lons = [31.0 + 0.013 * i for i in range(20)]
+    lats = [30.0 + 0.007 * ((i * 7) % 20) for i in range(20)]
+    index = HospitalIndex(list(range(20)), [str(i) for i in range(20)], [0] * 20, lons, lats)
+    query_lons, query_lats = [31.05, 31.2, 30.5], [30.05, 30.1, 29.0]
+    for (indices, distances), qlon, qlat in zip(
+        index.nearest(query_lons, query_lats, k=3), query_lons, query_lats
+    ):
+        expected = sorted(haversine_meters(qlon, qlat, lons, lats))[:3]
+        assert list(distances) == expected